@@ -0,0 +1,243 @@
+"""
+Benchmarks for the decision tree of hw2.py.
+
+Times the impurity functions, the split search, tree building, prediction
+and the pruning sweeps on synthetic categorical datasets and on the bundled
+mushroom dataset, records the peak memory of every benchmark and writes the
+results as JSON. A previous result file can be given as a baseline, in which
+case the run fails when a benchmark got slower than the allowed threshold.
+The run also fails when batch prediction disagrees with predict, or when
+encoding a micro-batch costs much more than routing it.
+
+Usage:
+    python bench.py --output bench.json
+    python bench.py --baseline bench.json --threshold 0.25
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import hw2
+
+MUSHROOM_CSV = 'agaricus-lepiota.csv'
+
+# name -> (n_rows, n_features, cardinality, n_classes)
+SYNTHETIC = {'small': (2000, 10, 4, 2),
+             'wide': (5000, 60, 6, 2),
+             'high_cardinality': (5000, 12, 40, 3),
+             'tall': (50000, 16, 8, 3)}
+
+QUICK = {'small': (2000, 10, 4, 2)}
+
+MICRO_BATCH = 16 # instances per batch of the serving benchmarks and checks
+
+
+def make_dataset(n_rows, n_features, cardinality, n_classes, seed=0):
+    """
+    Generate a categorical dataset where the last column holds the labels.
+
+    The labels depend on the first features (with some noise), so trees have
+    something to learn. Values are strings like the mushroom dataset's.
+
+    Input:
+    - n_rows: the number of instances.
+    - n_features: the number of categorical features.
+    - cardinality: the number of distinct values of every feature.
+    - n_classes: the number of distinct labels.
+    - seed: the seed of the random generator.
+
+    Output: an object array of shape (n_rows, n_features + 1).
+    """
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, cardinality, size=(n_rows, n_features))
+    informative = codes[:, :min(3, n_features)].sum(axis=1)
+    noise = rng.random(n_rows) < 0.1
+    labels = np.where(noise, rng.integers(0, n_classes, n_rows), informative % n_classes)
+    data = np.empty((n_rows, n_features + 1), dtype=object)
+    data[:, :-1] = np.char.add('v', codes.astype(str))
+    data[:, -1] = np.char.add('c', labels.astype(str))
+    return data
+
+
+def load_mushroom(path=MUSHROOM_CSV):
+    data = pd.read_csv(path).dropna(axis=1)
+    return np.column_stack([data.drop('class', axis=1), data['class']])
+
+
+def split_dataset(data, seed=0):
+    """
+    Shuffle a dataset and split it into 75% training and 25% validation data.
+    """
+    rng = np.random.default_rng(seed)
+    data = data[rng.permutation(len(data))]
+    cut = int(len(data) * 0.75)
+    return data[:cut], data[cut:]
+
+
+def measure(func, repeat):
+    """
+    Run func repeat times.
+
+    Returns:
+    - seconds: the fastest run time.
+    - peak_bytes: the peak memory allocated during the first run.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    best = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best, peak_bytes
+
+
+def dataset_benchmarks(X_train, X_validation, sweeps):
+    """
+    Return the (name, function) pairs benchmarked on one dataset.
+    """
+    tree = hw2.DecisionTree(X_train, impurity_func=hw2.calc_entropy)
+    tree.build_tree()
+    tree.compile()
+    predictor = tree.compile().predictor()
+    node = hw2.DecisionNode(X_train, hw2.calc_gini)
+
+    benchmarks = [
+        ('calc_gini', lambda: hw2.calc_gini(X_train)),
+        ('calc_entropy', lambda: hw2.calc_entropy(X_train)),
+        ('goodness_of_split', lambda: [node.goodness_of_split(feature)
+                                       for feature in range(X_train.shape[1] - 1)]),
+        ('build_tree', lambda: hw2.DecisionTree(X_train, impurity_func=hw2.calc_entropy).build_tree()),
+        ('build_tree_level', lambda: hw2.DecisionTree(X_train, impurity_func=hw2.calc_entropy,
+                                                      growth='level').build_tree()),
+        ('build_tree_best_16', lambda: hw2.DecisionTree(X_train, impurity_func=hw2.calc_entropy, growth='best',
+                                                        max_leaf_nodes=16).build_tree()),
+        ('build_tree_gain_ratio_chi', lambda: hw2.DecisionTree(X_train, impurity_func=hw2.calc_gini,
+                                                               gain_ratio=True, chi=0.05).build_tree()),
+        ('predict', lambda: [tree.predict(row) for row in X_validation]),
+        ('predict_batch', lambda: tree.predict_batch(X_validation)),
+        ('predict_batch_{}'.format(MICRO_BATCH), lambda: [tree.predict_batch(X_validation[start:start + MICRO_BATCH])
+                                                          for start in range(0, len(X_validation), MICRO_BATCH)]),
+        ('predict_generated', lambda: [predictor(row) for row in X_validation]),
+        ('calc_accuracy', lambda: tree.calc_accuracy(X_validation)),
+    ]
+    if sweeps:
+        benchmarks += [
+            ('depth_pruning', lambda: _uncached(hw2.depth_pruning, X_train, X_validation)),
+            ('chi_pruning', lambda: _uncached(hw2.chi_pruning, X_train, X_validation)),
+        ]
+    return benchmarks
+
+
+def check_batch_prediction(X_train, X_validation, max_encode_ratio=8.0, repeat=5):
+    """
+    Check the batch prediction path of a tree: predict_batch must predict
+    exactly like predict, and encoding a micro-batch must not cost more than
+    max_encode_ratio times routing it (the lookups of the vocabularies are
+    built once per compiled tree, not per batch).
+
+    Returns: the list of failure messages.
+    """
+    tree = hw2.DecisionTree(X_train, impurity_func=hw2.calc_entropy)
+    tree.build_tree()
+    compiled = tree.compile()
+    failures = []
+    if list(compiled.predict_batch(X_validation)) != [tree.predict(row) for row in X_validation]:
+        failures.append('predict_batch differs from predict')
+    batch = X_validation[:MICRO_BATCH]
+    codes = compiled.encode(batch)
+    encode_seconds, _ = measure(lambda: [compiled.encode(batch) for _ in range(100)], repeat)
+    apply_seconds, _ = measure(lambda: [compiled.apply(codes) for _ in range(100)], repeat)
+    if encode_seconds > max_encode_ratio * apply_seconds:
+        failures.append('encoding {} instances takes {:.0f}us, routing them {:.0f}us'.format(
+            MICRO_BATCH, encode_seconds * 1e4, apply_seconds * 1e4))
+    return failures
+
+
+def _uncached(func, *args):
+    # Sweeps are timed from a cold split cache, in the calling process
+    hw2.SPLIT_CACHE.clear()
+    return func(*args, n_jobs=1)
+
+
+def run(datasets, repeat, sweeps):
+    results = []
+    for name, data in datasets.items():
+        X_train, X_validation = split_dataset(data)
+        for bench, func in dataset_benchmarks(X_train, X_validation, sweeps):
+            seconds, peak_bytes = measure(func, repeat)
+            results.append({'dataset': name, 'benchmark': bench,
+                            'rows': len(data), 'columns': data.shape[1],
+                            'seconds': seconds, 'peak_bytes': peak_bytes})
+            print('{:<18} {:<26} {:>10.4f}s {:>12,d}B'.format(name, bench, seconds, peak_bytes))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline run.
+
+    Returns: the list of (dataset, benchmark, baseline seconds, seconds) of the
+             benchmarks that got slower than baseline * (1 + threshold).
+    """
+    reference = {(r['dataset'], r['benchmark']): r['seconds'] for r in baseline['results']}
+    regressions = []
+    for result in results:
+        key = (result['dataset'], result['benchmark'])
+        if key in reference and result['seconds'] > reference[key] * (1 + threshold):
+            regressions.append(key + (reference[key], result['seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='a JSON result file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown relative to the baseline (default: 0.2)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the fastest counts')
+    parser.add_argument('--quick', action='store_true', help='only the small synthetic dataset')
+    parser.add_argument('--no-sweeps', action='store_true', help='skip depth_pruning and chi_pruning')
+    args = parser.parse_args(argv)
+
+    datasets = {}
+    for name, shape in (QUICK if args.quick else SYNTHETIC).items():
+        datasets[name] = make_dataset(*shape)
+    if not args.quick:
+        datasets['mushroom'] = load_mushroom()
+
+    results = run(datasets, args.repeat, sweeps=not args.no_sweeps)
+    failures = []
+    for name, data in datasets.items():
+        failures += ['{}: {}'.format(name, failure) for failure in check_batch_prediction(*split_dataset(data))]
+    for failure in failures:
+        print('FAILED ' + failure)
+    report = {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                       'platform': platform.platform(), 'repeat': args.repeat},
+              'results': results, 'failures': failures}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for dataset, bench, before, after in regressions:
+            print('REGRESSION {} {}: {:.4f}s -> {:.4f}s'.format(dataset, bench, before, after))
+        if regressions:
+            return 1
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,14 @@
-from collections import deque
+import copy
+import hashlib
+import heapq
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
 
 import numpy as np
 import pandas as pd
@@ -66,6 +76,217 @@ chi_table = {1: {0.5 : 0.45,
               0.0001 : 100000}}
 
 
+def chi2_sf(x, dof):
+    """
+    Calculate the chi square survival function, i.e. the p-value of a statistic.
+
+    Input:
+    - x: the chi square statistic.
+    - dof: the degrees of freedom (a positive integer).
+
+    Returns:
+    - p: the probability that a chi square variable with dof degrees of freedom exceeds x.
+    """
+    if x <= 0:
+        return 1.0
+    a, z = dof / 2, x / 2
+    log_prefix = a * math.log(z) - z - math.lgamma(a)
+    if z < a + 1:
+        # Series of the lower regularized incomplete gamma function
+        term = total = 1 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= z / n
+            total += term
+        return max(0.0, 1 - total * math.exp(log_prefix))
+    # Continued fraction of the upper regularized incomplete gamma function (modified Lentz)
+    tiny = 1e-300
+    b = z + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, math.exp(log_prefix) * h)
+
+
+def chi2_critical_value(p, dof):
+    """
+    Calculate the chi square statistic whose p-value is p (the inverse of chi2_sf).
+
+    Input:
+    - p: the p-value cut-off, between 0 and 1.
+    - dof: the degrees of freedom (a positive integer).
+
+    Returns:
+    - x: the statistic with chi2_sf(x, dof) == p.
+    """
+    low, high = 0.0, max(1.0, 2.0 * dof)
+    while chi2_sf(high, dof) > p:
+        high *= 2
+    for _ in range(200):
+        mid = (low + high) / 2
+        if chi2_sf(mid, dof) > p:
+            low = mid
+        else:
+            high = mid
+        if high - low <= 1e-12 * high:
+            break
+    return (low + high) / 2
+
+
+def chi_threshold(dof, p):
+    """
+    Return the chi square statistic a split needs to survive chi pruning.
+
+    The value of chi_table is used for the degrees of freedom and p-values it
+    holds, so existing cut-offs keep pruning exactly as before; any other
+    combination is computed with chi2_critical_value.
+
+    Input:
+    - dof: the degrees of freedom of the split.
+    - p: the p-value cut-off.
+
+    Returns: the threshold statistic.
+    """
+    if dof in chi_table and p in chi_table[dof]:
+        return chi_table[dof][p]
+    return chi2_critical_value(p, dof)
+
+
+def chi_square_statistic(table):
+    """
+    Calculate the chi square statistic of a contingency table.
+
+    Input:
+    - table: array of shape (groups, classes) holding the number of instances
+             of every class in every group of a split.
+
+    Returns:
+    - chi_square: the sum over the cells of (observed - expected)^2 / expected,
+                  where expected follows the class distribution of the whole table.
+    """
+    table = np.asarray(table, dtype=float)
+    class_totals = table.sum(axis=0)
+    expected = (class_totals / class_totals.sum()) * table.sum(axis=1)[:, None]
+    terms = np.divide((table - expected) ** 2, expected, out=np.zeros_like(table), where=expected > 0)
+    return float(terms.sum())
+
+
+### Impurity measures ###
+# The impurity kernels work on class counts: the last axis of their input
+# holds the number of instances of every class, and any leading axes are a
+# batch of count vectors (e.g. one per child group of a split). The data level
+# impurity functions (calc_gini, calc_entropy, ...) count the labels of a
+# dataset and apply a kernel.
+
+def _sequential_sum(terms):
+    """
+    Sum the last axis of terms strictly left to right, like a Python loop
+    accumulating them. np.sum adds in pairs, whose rounding differs in the
+    last bits, and exactly tied splits would then be broken differently.
+    """
+    if terms.shape[-1] == 0:
+        return np.zeros(terms.shape[:-1])
+    return np.cumsum(terms, axis=-1)[..., -1]
+
+
+def _by_decreasing_count(p):
+    """
+    Order the class probabilities of the last axis from the most frequent
+    class down, the order of pd.Series.value_counts the class sums used to
+    follow (classes of equal count contribute equal terms, so their order
+    does not matter).
+    """
+    return -np.sort(-p, axis=-1)
+
+
+def _squares(p):
+    """
+    Square p elementwise exactly as Python's ** squares a float. ** calls the
+    C library pow, which now and then rounds a square lying almost halfway
+    between two floats the other way than p * p does. The exact rounding error
+    of p * p finds those few squares, and they are recomputed with **.
+    """
+    squares = p * p
+    high = p * 134217729.0 # 2 ** 27 + 1 splits p into two halves whose products are exact
+    high = high - (high - p)
+    low = p - high
+    error = ((high * high - squares) + 2 * high * low) + low * low
+    close = np.abs(error) > 0.47 * np.spacing(squares)
+    if close.any():
+        squares[close] = [value ** 2 for value in p[close].tolist()]
+    return squares
+
+
+def gini_from_counts(counts):
+    """
+    Calculate the gini impurity from class counts.
+
+    Input:
+    - counts: array whose last axis holds the number of instances per class.
+
+    Returns:
+    - gini: the gini impurity of every count vector (0 for empty vectors).
+    """
+    counts = np.asarray(counts, dtype=float)
+    totals = counts.sum(axis=-1, keepdims=True)
+    p = _by_decreasing_count(np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0))
+    return np.where(totals[..., 0] > 0, 1 - _sequential_sum(_squares(p)), 0.0)
+
+
+def entropy_from_counts(counts):
+    """
+    Calculate the entropy from class counts.
+
+    Input:
+    - counts: array whose last axis holds the number of instances per class.
+
+    Returns:
+    - entropy: the entropy of every count vector (0 for empty vectors).
+    """
+    counts = np.asarray(counts, dtype=float)
+    totals = counts.sum(axis=-1, keepdims=True)
+    p = _by_decreasing_count(np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0))
+    log_p = np.log2(p, out=np.zeros_like(p), where=p > 0)
+    return -1 * _sequential_sum(p * log_p)
+
+
+def misclassification_from_counts(counts):
+    """
+    Calculate the misclassification error from class counts.
+
+    Input:
+    - counts: array whose last axis holds the number of instances per class.
+
+    Returns:
+    - error: the misclassification error of every count vector (0 for empty vectors).
+    """
+    counts = np.asarray(counts, dtype=float)
+    totals = counts.sum(axis=-1)
+    majority = counts.max(axis=-1, initial=0)
+    return 1 - np.divide(majority, totals, out=np.ones_like(totals), where=totals > 0)
+
+
+def _label_counts(data):
+    """
+    Count the instances of every label of a dataset where the last column holds the labels.
+    """
+    _, counts = np.unique(data[:, -1], return_counts=True)
+    return counts
+
+
 def calc_gini(data):
     """
     Calculate gini impurity measure of a dataset.
@@ -80,14 +301,7 @@ def calc_gini(data):
     ###########################################################################
     # TODO: Implement the function.                                           #
     ###########################################################################
-    labels = data[:, -1]
-    label_counts = pd.Series(labels).value_counts().to_dict()
-    total = len(labels)
-
-    for label in label_counts:
-        gini += (label_counts[label] / total) ** 2
-
-    gini = 1 - gini
+    gini = float(gini_from_counts(_label_counts(data)))
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
@@ -108,27 +322,757 @@ def calc_entropy(data):
     ###########################################################################
     # TODO: Implement the function.                                           #
     ###########################################################################
-    labels = data[:, -1]
-    label_counts = pd.Series(labels).value_counts().to_dict()
-    total = len(labels)
-
-    for label in label_counts:
-        if label_counts[label] > 0:
-            entropy += (label_counts[label] / total) * np.log2(label_counts[label] / total)
-        else:
-            print("Feature {} has no children.".format(label))
-    entropy = -1 * entropy
+    entropy = float(entropy_from_counts(_label_counts(data)))
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
     return entropy
 
+
+# name -> data level impurity function, e.g. IMPURITY_FUNCS['gini'] is calc_gini
+IMPURITY_FUNCS = {}
+
+# data level impurity function -> impurity kernel, used by the split engine
+_COUNT_KERNELS = {}
+
+# name -> the (kernel, impurity_func) arguments of register_impurity, replayed in worker processes
+_IMPURITY_REGISTRATIONS = {}
+
+
+def register_impurity(name, kernel, impurity_func=None):
+    """
+    Register an impurity measure, making it usable by the trees and the sweeps.
+
+    Input:
+    - name: the name of the measure in sweep configurations.
+    - kernel: the impurity kernel, computing the measure from class counts.
+    - impurity_func: the data level function to pass to DecisionTree as the
+                     impurity_func. When omitted, one is created from the kernel.
+
+    Worker processes started by spawn (the default on macOS and Windows)
+    register the measures the parallel sweeps, cross-validation and forests
+    use again, so kernel and impurity_func must be picklable there, i.e.
+    module level functions.
+
+    Output: the data level impurity function.
+    """
+    _IMPURITY_REGISTRATIONS[name] = (kernel, impurity_func)
+    if impurity_func is None:
+        def impurity_func(data):
+            return float(kernel(_label_counts(data)))
+        impurity_func.__name__ = impurity_func.__qualname__ = 'calc_' + name
+        impurity_func.__doc__ = "Calculate the {} of a dataset where the last column holds the labels.".format(name)
+    IMPURITY_FUNCS[name] = impurity_func
+    _COUNT_KERNELS[impurity_func] = kernel
+    return impurity_func
+
+
+register_impurity('gini', gini_from_counts, calc_gini)
+register_impurity('entropy', entropy_from_counts, calc_entropy)
+calc_misclassification = register_impurity('misclassification', misclassification_from_counts)
+
+
+def _smallest_uint(max_value):
+    """
+    Return the smallest unsigned integer dtype able to hold max_value.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _bin_edges(values, counts, max_bins):
+    """
+    Choose the quantile bin edges of a numeric column.
+
+    Input:
+    - values: the distinct values of the column, ascending.
+    - counts: the number of instances of every value.
+    - max_bins: the maximal number of bins.
+
+    Returns:
+    - edges: ascending values of the column, bin i holding the values in
+             (edges[i - 1], edges[i]]. Columns with at most max_bins distinct
+             values get one bin per value.
+    """
+    if len(values) <= max_bins:
+        return np.asarray(values[:-1], dtype=float)
+    cumulative = np.cumsum(counts)
+    targets = cumulative[-1] * np.arange(1, max_bins) / max_bins
+    edges = np.unique(values[np.searchsorted(cumulative, targets)])
+    return edges[edges < values[-1]].astype(float)
+
+
+def _interval_vocab(edges):
+    """
+    The vocabulary of a binned numeric column: the interval of every bin,
+    from (-inf, edges[0]] to (edges[-1], inf).
+    """
+    breaks = np.concatenate([[-np.inf], edges, [np.inf]])
+    return np.array(list(pd.IntervalIndex.from_breaks(breaks, closed='right')), dtype=object)
+
+
+def _is_binned(vocab):
+    return len(vocab) > 0 and isinstance(vocab[0], pd.Interval)
+
+
+def _vocab_edges(vocab):
+    return np.array([interval.right for interval in vocab[:-1]], dtype=float)
+
+
+class EncodedDataset:
+    """
+    Integer encoding of a dataset where the last column holds the labels.
+
+    Every categorical column is encoded once into the codes 0..n_values-1,
+    following the sorted order of its distinct values (the order np.unique
+    returns them in), so grouping rows by code is the same as grouping them by
+    value. Numeric columns are quantile-binned once into at most max_bins
+    bins, whose vocabulary holds the interval (pd.Interval) of every bin; they
+    are split by thresholds rather than by value (see feature_scores).
+
+    An already encoded dataset (e.g. one living in shared memory) is wrapped
+    without copying by passing its codes and vocabs instead of data.
+    """
+
+    def __init__(self, data, codes=None, vocabs=None, numeric=(), max_bins=256):
+        self.data = data # the raw dataset that was encoded (may be None)
+        self.vocabs = vocabs # vocabs[col][code] = the raw value (or bin interval) of the code in column col
+        if codes is None:
+            self.vocabs = []
+            codes = np.empty(data.shape, dtype=np.intp)
+            for col in range(data.shape[1]):
+                if col in numeric:
+                    column = data[:, col].astype(float)
+                    edges = _bin_edges(*np.unique(column, return_counts=True), max_bins)
+                    self.vocabs.append(_interval_vocab(edges))
+                    codes[:, col] = np.searchsorted(edges, column, side='left')
+                    continue
+                vocab, inverse = np.unique(data[:, col], return_inverse=True)
+                self.vocabs.append(vocab)
+                codes[:, col] = inverse.reshape(-1)
+        self.n_values = np.array([len(vocab) for vocab in self.vocabs], dtype=np.intp)
+        if codes.dtype != _smallest_uint(self.n_values.max() - 1):
+            codes = codes.astype(_smallest_uint(self.n_values.max() - 1))
+        self.codes = codes # the encoded dataset
+        self.codes.setflags(write=False) # shared by every node of a tree, never modified
+        self.n_classes = int(self.n_values[-1])
+        # Every (feature, value) pair owns one bin, features are laid out one after the other
+        self.offsets = np.concatenate([[0], np.cumsum(self.n_values[:-2])]).astype(np.intp)
+        self.n_bins = int(self.n_values[:-1].sum())
+        self.numeric = [col for col in range(self.n_features) if _is_binned(self.vocabs[col])] # the binned features
+        # _sum_index[f] lists the bins of feature f, padded with the index of an extra zero bin
+        self._sum_index = np.full((self.n_features, self.n_values[:-1].max(initial=0)), self.n_bins, dtype=np.intp)
+        for feature in range(self.n_features):
+            self._sum_index[feature, :self.n_values[feature]] = self.offsets[feature] + np.arange(self.n_values[feature])
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def n_features(self):
+        return len(self.vocabs) - 1
+
+    @property
+    def fingerprint(self):
+        """
+        A digest of the codes and of how they are read (which features are
+        numeric, how many values or bins every column has), identifying the
+        encoded instances across encodings. The same codes scored as multiway
+        categorical or as binned numeric features give different splits.
+        """
+        if getattr(self, '_fingerprint', None) is None:
+            digest = hashlib.blake2b(np.ascontiguousarray(self.codes), digest_size=16)
+            digest.update(str(self.codes.shape).encode())
+            digest.update(str(tuple(self.numeric)).encode())
+            digest.update(str(tuple(self.n_values.tolist())).encode())
+            self._fingerprint = digest.digest()
+        return self._fingerprint
+
+    def strip(self):
+        """
+        Return a copy of the encoding that keeps the vocabularies but no instances.
+        """
+        stripped = copy.copy(self)
+        stripped.data = None
+        stripped.codes = None
+        return stripped
+
+    def take(self, rows):
+        """
+        Return the raw instances at the given positions, decoding them from
+        the codes when the raw dataset is not available.
+        """
+        if self.data is not None:
+            return self.data[rows]
+        codes = self.codes[rows]
+        return np.column_stack([vocab[codes[:, col]] for col, vocab in enumerate(self.vocabs)])
+
+    def feature_contingency(self, rows, feature):
+        """
+        Count the (value x class) co-occurrences of a single feature.
+
+        Returns:
+        - counts: array of shape (n_values[feature], n_classes).
+        """
+        flat = self.codes[rows, feature].astype(np.intp) * self.n_classes + self.codes[rows, -1]
+        counts = np.bincount(flat, minlength=self.n_values[feature] * self.n_classes)
+        return counts.reshape(self.n_values[feature], self.n_classes)
+
+    def group_rows(self, rows, feature):
+        """
+        Group instances by their code of a feature in one stable pass: a
+        counting sort of the codes (NumPy's stable sort is a radix sort for
+        the small unsigned codes) instead of one mask per value.
+
+        Input:
+        - rows: the positions of the instances to group.
+        - feature: the column to group by.
+
+        Returns:
+        - grouped: rows reordered so that instances sharing a code are contiguous,
+                   in code order and keeping their relative order.
+        - present: the codes of the groups, ascending.
+        - bounds: grouped[bounds[i]:bounds[i + 1]] are the instances of code present[i].
+        """
+        codes = self.codes[rows, feature]
+        sizes = np.bincount(codes, minlength=self.n_values[feature])
+        present = np.flatnonzero(sizes)
+        bounds = np.concatenate([[0], np.cumsum(sizes[present])])
+        return rows[np.argsort(codes, kind='stable')], present, bounds
+
+    def class_counts(self, rows):
+        """
+        Count the instances of every class among the given rows.
+        """
+        return np.bincount(self.codes[rows, -1], minlength=self.n_classes)
+
+    def contingency(self, rows, start=0, stop=None):
+        """
+        Count the (feature value x class) co-occurrences of every feature at once.
+
+        Input:
+        - rows: the positions of the instances to count.
+        - start, stop: count only the features start..stop-1 (default: all of them).
+
+        Returns:
+        - counts: array of shape (n_bins, n_classes). The rows of feature f are
+                  counts[offsets[f]:offsets[f] + n_values[f]]. When a range of
+                  features is given, only their rows, starting at feature start.
+        """
+        stop = self.n_features if stop is None else stop
+        first_bin = self.offsets[start] if start < self.n_features else self.n_bins
+        n_bins = (self.offsets[stop] if stop < self.n_features else self.n_bins) - first_bin
+        bins = self.codes[rows, start:stop].astype(np.intp) + (self.offsets[start:stop] - first_bin)
+        flat = bins * self.n_classes + self.codes[rows, -1:].astype(np.intp)
+        counts = np.bincount(flat.reshape(-1), minlength=n_bins * self.n_classes)
+        return counts.reshape(n_bins, self.n_classes)
+
+    def feature_scores(self, counts, kernel, gain_ratio=False):
+        """
+        Calculate the goodness of split of every feature from a contingency table.
+
+        Input:
+        - counts: the output of self.contingency for some set of rows, or a
+                  stack of such tables (any leading axes are a batch of nodes).
+        - kernel: the count based impurity function.
+        - gain_ratio: True iff GainRatio is used to score features.
+
+        Returns:
+        - scores: the goodness of split (or gain ratio) of every feature, with
+                  the leading axes of counts.
+        """
+        if self.n_features == 0:
+            return np.empty(counts.shape[:-2] + (0,))
+        parent = counts[..., :self.n_values[0], :].sum(axis=-2)
+        total_rows = parent.sum(axis=-1, keepdims=True)
+        phi_s = kernel(parent)[..., None]
+        sizes = counts.sum(axis=-1)
+        weights = sizes / total_rows
+        impurities = self._feature_sums(weights * kernel(counts))
+        scores = phi_s - impurities
+        if gain_ratio:
+            log_w = np.log2(weights, out=np.zeros_like(weights), where=weights > 0)
+            split_info = -1 * self._feature_sums(weights * log_w)
+            scores = np.divide(scores, split_info, out=np.zeros_like(scores), where=split_info > 0)
+        for feature in self.numeric:
+            cuts = self.cut_scores(self.feature_block(counts, feature), kernel, gain_ratio)
+            scores[..., feature] = cuts.max(axis=-1, initial=0)
+        return scores
+
+    def feature_score(self, table, feature, kernel, gain_ratio=False):
+        """
+        Calculate the goodness of split of a single feature from its own
+        (value x class) table, as returned by feature_contingency. Gives the
+        same value as feature_scores does for the feature.
+        """
+        if feature in self.numeric:
+            return float(self.cut_scores(table, kernel, gain_ratio).max(initial=0))
+        parent = table.sum(axis=0)
+        weights = table.sum(axis=1) / parent.sum()
+        score = kernel(parent) - _sequential_sum(weights * kernel(table))
+        if gain_ratio:
+            log_w = np.log2(weights, out=np.zeros_like(weights), where=weights > 0)
+            split_info = -1 * _sequential_sum(weights * log_w)
+            score = score / split_info if split_info > 0 else 0.0
+        return float(score)
+
+    def _feature_sums(self, terms):
+        """
+        Sum the per bin terms of every feature in value order (see _sequential_sum).
+        The bins of every feature are gathered into one row padded with zeros,
+        which leave the sums unchanged.
+        """
+        padded = np.concatenate([terms, np.zeros(terms.shape[:-1] + (1,))], axis=-1)
+        return _sequential_sum(padded[..., self._sum_index])
+
+    def feature_block(self, counts, feature):
+        """
+        The (value x class) rows of a feature in a contingency table.
+        """
+        start = self.offsets[feature]
+        return counts[..., start:start + self.n_values[feature], :]
+
+    def cut_scores(self, block, kernel, gain_ratio=False):
+        """
+        Calculate the goodness of split of the binary splits of a numeric
+        feature, from the cumulative class histogram of its bins: the first
+        child of cut k holds bins 0..k, the other is the parent minus it.
+
+        Input:
+        - block: the feature's (bin x class) counts, as returned by feature_block.
+        - kernel: the count based impurity function.
+        - gain_ratio: True iff GainRatio is used to score the cuts.
+
+        Returns:
+        - scores: the goodness of split (or gain ratio) of every cut, 0 for
+                  cuts leaving a child empty.
+        """
+        left = np.cumsum(block, axis=-2)[..., :-1, :]
+        parent = block.sum(axis=-2, keepdims=True)
+        right = parent - left
+        total_rows = parent.sum(axis=-1)
+        left_weights = np.divide(left.sum(axis=-1), total_rows, out=np.zeros(left.shape[:-1]), where=total_rows > 0)
+        right_weights = 1 - left_weights
+        scores = kernel(parent) - left_weights * kernel(left) - right_weights * kernel(right)
+        if gain_ratio:
+            split_info = np.zeros_like(scores)
+            for weights in (left_weights, right_weights):
+                split_info -= weights * np.log2(weights, out=np.zeros_like(weights), where=weights > 0)
+            scores = np.divide(scores, split_info, out=np.zeros_like(scores), where=split_info > 0)
+        return np.where((left_weights > 0) & (right_weights > 0), scores, 0.0)
+
+    def best_cut(self, block, kernel, gain_ratio=False):
+        """
+        Return the bin code k of the best binary split of a numeric feature
+        (codes <= k go to the first child), the first one among equals.
+        """
+        return int(np.argmax(self.cut_scores(block, kernel, gain_ratio)))
+
+
+class SplitCache:
+    """
+    A bounded LRU cache of split statistics (the goodness of split of every
+    feature) shared by the trees built in one process.
+
+    Entries are keyed by the node's instances (the fingerprint of the training
+    data and a digest of the node's row positions), the impurity function and
+    the gain_ratio flag, so a node that appears in several trees - e.g. trees
+    that only differ by max_depth or chi - is scored once.
+    """
+
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize # the maximal number of entries held
+        self.hits = 0 # lookups answered from the cache
+        self.misses = 0 # lookups that had to be computed
+        self._entries = OrderedDict() # key -> feature scores, least recently used first
+
+    def key(self, encoded, rows, impurity_func, gain_ratio):
+        digest = hashlib.blake2b(np.ascontiguousarray(rows), digest_size=16).digest()
+        return (encoded.fingerprint, len(rows), digest, impurity_func, gain_ratio)
+
+    def get(self, key):
+        """
+        Return the cached scores of a key, or None when they are not cached.
+        """
+        scores = self._entries.get(key)
+        if scores is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return scores
+
+    def put(self, key, scores):
+        scores.setflags(write=False)
+        self._entries[key] = scores
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+# The cache used by the sweeps, one per process
+SPLIT_CACHE = SplitCache()
+
+
+# Nodes with fewer instances are scored serially, a thread pool costs more than it saves
+_PARALLEL_SPLIT_MIN_ROWS = 20000
+
+
+class SplitExecutor:
+    """
+    Scores the candidate features of large nodes concurrently in a thread pool.
+
+    The features are cut into one contiguous block per worker and the
+    contingency table of every block is counted in its own thread (the NumPy
+    gathers and arithmetic release the GIL), then the blocks are joined in
+    feature order. The counts are exact, so the scores - and the feature
+    chosen by the first maximum - are the same as a serial search's. Nodes
+    with fewer than min_rows instances are always scored serially.
+    """
+
+    def __init__(self, n_workers=None, min_rows=_PARALLEL_SPLIT_MIN_ROWS):
+        self.n_workers = n_workers or os.cpu_count() or 1 # the number of threads
+        self.min_rows = min_rows # the minimal number of instances of a node scored in parallel
+        self._pool = ThreadPoolExecutor(self.n_workers) if self.n_workers > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _parallel(self, rows, n_features):
+        return self._pool is not None and n_features > 1 and len(rows) >= self.min_rows
+
+    def contingency(self, encoded, rows):
+        """
+        Count the contingency table of the instances rows, like encoded.contingency(rows).
+        """
+        if not self._parallel(rows, encoded.n_features):
+            return encoded.contingency(rows)
+        bounds = np.linspace(0, encoded.n_features, min(self.n_workers, encoded.n_features) + 1).astype(int)
+        blocks = self._pool.map(lambda block: encoded.contingency(rows, *block), zip(bounds[:-1], bounds[1:]))
+        return np.concatenate(list(blocks))
+
+    def goodness(self, node):
+        """
+        Calculate the goodness of split of every feature of a node with node.goodness_of_split.
+        """
+        features = range(node.encoded.n_features)
+        if not self._parallel(node.rows, len(features)):
+            return [node.goodness_of_split(feature)[0] for feature in features]
+        return [goodness for goodness, _ in self._pool.map(node.goodness_of_split, features)]
+
+
+class BuildStats:
+    """
+    Instrumentation of a tree build: the time spent in every phase of the
+    node splits, the number of nodes per depth, the peak frontier size and the
+    bytes of training data the nodes hold.
+
+    A BuildStats is only created when a build is instrumented, nodes skip all
+    the bookkeeping otherwise.
+    """
+
+    PHASES = ('impurity', 'partition', 'chi_square', 'node_creation')
+
+    def __init__(self, callback=None):
+        self.callback = callback # called as callback(node, stats) after every node split
+        self.phase_times = {phase: 0.0 for phase in self.PHASES} # seconds spent per phase
+        self.n_nodes = 0 # the number of nodes split (every node of the tree is split once)
+        self.nodes_per_depth = {} # depth -> number of nodes
+        self.peak_frontier = 0 # the maximal number of nodes waiting to be split
+        self.data_bytes = 0 # bytes of training data held by the nodes (codes and row positions)
+        self.elapsed = 0.0 # seconds spent building the tree
+        self._start = time.perf_counter()
+
+    @property
+    def nodes_per_second(self):
+        return self.n_nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def lap(self, phase, start):
+        """
+        Add the time since start to a phase and return the current time.
+        """
+        now = time.perf_counter()
+        self.phase_times[phase] += now - start
+        return now
+
+    def node_done(self, node, frontier_size):
+        """
+        Record a split node and the number of nodes still waiting to be split.
+        """
+        self.n_nodes += 1
+        self.nodes_per_depth[node.depth] = self.nodes_per_depth.get(node.depth, 0) + 1
+        self.peak_frontier = max(self.peak_frontier, frontier_size)
+        self.elapsed = time.perf_counter() - self._start
+        if self.callback is not None:
+            self.callback(node, self)
+
+    def finish(self, tree):
+        self.elapsed = time.perf_counter() - self._start
+        if tree.encoded.codes is not None:
+            self.data_bytes = tree.encoded.codes.nbytes
+        if tree.root.rows is not None:
+            base = tree.root.rows if tree.root.rows.base is None else tree.root.rows.base
+            self.data_bytes += base.nbytes
+
+    def summary(self):
+        return {'elapsed': self.elapsed,
+                'n_nodes': self.n_nodes,
+                'nodes_per_second': self.nodes_per_second,
+                'phase_times': dict(self.phase_times),
+                'nodes_per_depth': dict(sorted(self.nodes_per_depth.items())),
+                'peak_frontier': self.peak_frontier,
+                'data_bytes': self.data_bytes}
+
+    def __repr__(self):
+        return 'BuildStats({})'.format(self.summary())
+
+
+def _column_lookups(vocabs):
+    """
+    Build the lookup of every vocabulary used to encode raw values: a dict from
+    value to code for a categorical column, the bin edges for a binned numeric
+    column. Building them costs more than encoding a small batch, so holders of
+    vocabularies that encode repeatedly (e.g. CompiledTree) keep them.
+    """
+    return [_vocab_edges(vocab) if _is_binned(vocab) else {value: code for code, value in enumerate(vocab)}
+            for vocab in vocabs]
+
+
+def _encode_columns(X, vocabs, lookups=None):
+    """
+    Encode raw instances with the vocabularies of an EncodedDataset.
+
+    Input:
+    - X: a 2D array of instances. Columns beyond len(vocabs) (e.g. the labels) are ignored.
+    - vocabs: the vocabulary of every column to encode.
+    - lookups: the _column_lookups of vocabs, built when not given.
+
+    Returns:
+    - codes: an integer array of shape (len(X), len(vocabs)), where values that
+             are missing from a vocabulary are encoded as -1.
+    """
+    X = np.asarray(X)
+    if lookups is None:
+        lookups = _column_lookups(vocabs)
+    n = X.shape[0]
+    codes = np.empty((n, len(vocabs)), dtype=np.intp)
+    for col, vocab in enumerate(vocabs):
+        if _is_binned(vocab):
+            codes[:, col] = np.searchsorted(lookups[col], X[:, col].astype(float), side='left')
+        else:
+            codes[:, col] = np.fromiter(map(lookups[col].get, X[:, col], repeat(-1, n)), dtype=np.intp, count=n)
+    return codes
+
+
+def _translate_codes(encoded, vocabs, rows=slice(None), lookups=None):
+    """
+    Re-encode the codes of an EncodedDataset with other vocabularies, without
+    decoding the instances.
+
+    Input:
+    - encoded: an EncodedDataset.
+    - vocabs: the vocabularies of the leading columns to re-encode.
+    - rows: the instances to re-encode (default: all of them).
+    - lookups: the _column_lookups of vocabs, if already built.
+
+    Returns:
+    - codes: the codes of the leading len(vocabs) columns in the given vocabularies,
+             where values that are missing from a vocabulary are encoded as -1.
+             When the vocabularies agree this is a view of encoded.codes.
+    """
+    n_columns = len(vocabs)
+    if all(np.array_equal(encoded.vocabs[col], vocabs[col]) for col in range(n_columns)):
+        return encoded.codes[rows, :n_columns]
+    source = encoded.codes[rows]
+    codes = np.empty((len(source), n_columns), dtype=np.intp)
+    for col in range(n_columns):
+        if lookups is None or _is_binned(vocabs[col]):
+            table = pd.Index(vocabs[col]).get_indexer(encoded.vocabs[col])
+        else:
+            table = np.array([lookups[col].get(value, -1) for value in encoded.vocabs[col]], dtype=np.intp)
+        codes[:, col] = table[source[:, col]]
+    return codes
+
+
+### Binary files ###
+# A binary file holds JSON metadata followed by raw arrays, each starting at a
+# 64 byte aligned offset so it can be memory-mapped in place.
+
+_BINARY_MAGIC = b'HW2BIN01'
+_BINARY_ALIGNMENT = 64
+
+
+def _aligned(size):
+    return -(-size // _BINARY_ALIGNMENT) * _BINARY_ALIGNMENT
+
+
+def _write_binary(path, meta, arrays):
+    """
+    Write JSON serializable metadata and named arrays to a binary file.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    specs = {}
+    size = 0
+    for name, array in arrays.items():
+        specs[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': size}
+        size += _aligned(array.nbytes)
+    header = json.dumps({'meta': meta, 'arrays': specs}).encode()
+    start = _aligned(len(_BINARY_MAGIC) + 8 + len(header))
+
+    with open(path, 'wb') as f:
+        f.write(_BINARY_MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(start + specs[name]['offset'])
+            array.tofile(f)
+        f.truncate(start + size)
+
+
+def _read_binary(path, mmap=True):
+    """
+    Read a file written by _write_binary.
+
+    Input:
+    - path: the binary file.
+    - mmap: True to memory-map the arrays (read-only) instead of reading them.
+
+    Returns:
+    - meta: the metadata.
+    - arrays: dict mapping array name -> array.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(_BINARY_MAGIC)) != _BINARY_MAGIC:
+            raise ValueError("{} is not a binary file of this module".format(path))
+        header_size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_size))
+    start = _aligned(len(_BINARY_MAGIC) + 8 + header_size)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        count = int(np.prod(shape))
+        if count == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=start + spec['offset'], shape=shape)
+        else:
+            arrays[name] = np.fromfile(path, dtype=dtype, count=count,
+                                       offset=start + spec['offset']).reshape(shape)
+    return header['meta'], arrays
+
+
+def _json_vocabs(vocabs):
+    return [{'edges': _vocab_edges(vocab).tolist()} if _is_binned(vocab) else
+            [val.item() if isinstance(val, np.generic) else val for val in vocab] for vocab in vocabs]
+
+
+def _vocabs_from_json(vocabs):
+    return [_interval_vocab(np.array(vocab['edges'], dtype=float)) if isinstance(vocab, dict) else
+            np.array(vocab, dtype=object) for vocab in vocabs]
+
+
+def _py_literal(value):
+    """
+    The Python literal of a vocabulary value, for generated source.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    return repr(value)
+
+
+def load_model(path, mmap=True):
+    """
+    Load a tree written by CompiledTree.save (or DecisionTree.save). With mmap
+    the arrays are read-only memory maps of the file, so loading parses only
+    the vocabularies and serving processes that load the same file share its
+    pages. The lookups encoding raw values are built at load time too.
+
+    Input:
+    - path: the model file.
+    - mmap: True to memory-map the arrays instead of reading them.
+
+    Output: a CompiledTree.
+    """
+    meta, arrays = _read_binary(path, mmap)
+    if meta.get('kind') != 'tree':
+        raise ValueError("{} is not a tree model file".format(path))
+    vocabs = _vocabs_from_json(meta['vocabs'])
+    compiled = CompiledTree(arrays['feature'], arrays['child_offset'], arrays['child_table'],
+                            arrays['pred'], vocabs, arrays.get('importance'))
+    compiled.lookups # built now rather than by the first batch served
+    return compiled
+
+
+def save_encoded(path, data):
+    """
+    Encode a categorical dataset and write it to a compact binary file: the
+    codes of every column (uint8 for up to 256 values) and the vocabularies.
+
+    Input:
+    - path: the file to write.
+    - data: a dataset where the last column holds the labels, or an EncodedDataset.
+            The values must be JSON serializable (e.g. strings or numbers).
+
+    This function has no return value
+    """
+    encoded = data if isinstance(data, EncodedDataset) else EncodedDataset(data)
+    _write_binary(path, {'vocabs': _json_vocabs(encoded.vocabs)}, {'codes': encoded.codes})
+
+
+def load_encoded(path, mmap=True):
+    """
+    Load a dataset written by save_encoded. With mmap the codes are a read-only
+    memory map of the file, so processes that load the same file share its
+    pages and nothing is parsed but the vocabularies.
+
+    Input:
+    - path: the binary file.
+    - mmap: True to memory-map the codes instead of reading them.
+
+    Output: an EncodedDataset, usable as the data of a DecisionTree or
+            the dataset of calc_accuracy.
+    """
+    meta, arrays = _read_binary(path, mmap)
+    if 'codes' not in arrays:
+        raise ValueError("{} is not an encoded dataset file".format(path))
+    vocabs = _vocabs_from_json(meta['vocabs'])
+    return EncodedDataset(None, codes=arrays['codes'], vocabs=vocabs)
+
+
 class DecisionNode:
 
     
-    def __init__(self, data, impurity_func, feature=-1,depth=0, chi=1, max_depth=1000, gain_ratio=False):
+    def __init__(self, data, impurity_func, feature=-1,depth=0, chi=1, max_depth=1000, gain_ratio=False,
+                 encoded=None, rows=None, split_cache=None, class_counts=None, stats=None,
+                 split_executor=None, max_features=None, rng=None):
         
-        self.data = data # the data instances associated with the node
+        self.encoded = encoded if encoded is not None else EncodedDataset(data) # shared integer encoding of the training data
+        if rows is None and data is not None:
+            rows = np.arange(len(data))
+        self.rows = rows # positions of the node's instances in the training data (None when trained from counts)
+        if class_counts is None:
+            class_counts = self.encoded.class_counts(self.rows)
+        self.class_counts = class_counts # the number of instances of every class in the node
         self.terminal = False # True iff node is a leaf
         self.feature = feature # column index of feature/attribute used for splitting the node
         self.pred = self.calc_node_pred() # the class prediction associated with the node
@@ -139,7 +1083,28 @@ class DecisionNode:
         self.chi = chi # the P-value cutoff used for chi square pruning
         self.impurity_func = impurity_func # the impurity function to use for measuring goodness of a split
         self.gain_ratio = gain_ratio # True iff GainRatio is used to score features
+        self.split_cache = split_cache # the SplitCache shared with other trees, if any
+        self.stats = stats # the BuildStats of an instrumented build, if any
+        self.split_executor = split_executor # the SplitExecutor scoring the features of large nodes, if any
+        self.split_counts = None # the node's contingency table, kept by DecisionTree.update
+        self.max_features = max_features # the number of features drawn as split candidates (None: all of them)
+        self.rng = rng # the random generator drawing the candidate features
+        self.chi_square = None # the chi square statistic of the best split, set by split
+        self.degrees_of_freedom = None # the degrees of freedom of self.chi_square
         self.feature_importance = 0
+        self.goodness = None # the goodness of split of the split feature, recorded by split
+        self.threshold = None # numeric splits send values <= threshold to the first child, the others to the second
+        self.threshold_code = None # the bin code of threshold (codes <= threshold_code go to the first child)
+
+    @property
+    def data(self):
+        """
+        The data instances associated with the node, gathered from the shared
+        training data on access (None once the tree released its training data).
+        """
+        if self.rows is None:
+            return None
+        return self.encoded.take(self.rows)
     
     def calc_node_pred(self):
         """
@@ -152,9 +1117,7 @@ class DecisionNode:
         ###########################################################################
         # TODO: Implement the function.                                           #
         ###########################################################################
-        labels = self.data[:, -1]
-        values, counts = np.unique(labels, return_counts=True)
-        pred = values[np.argmax(counts)]
+        pred = self.encoded.vocabs[-1][np.argmax(self.class_counts)]
         ###########################################################################
         #                             END OF YOUR CODE                            #
         ###########################################################################
@@ -192,13 +1155,20 @@ class DecisionNode:
         ###########################################################################
         # TODO: Implement the function.                                           #
         ###########################################################################
+        kernel = _COUNT_KERNELS.get(self.impurity_func)
+        if kernel is not None and 0 <= feature < self.encoded.n_features:
+            table = self.encoded.feature_contingency(self.rows, feature)
+            goodness = self.encoded.feature_score(table, feature, kernel, self.gain_ratio)
+            for val, rows in self._partition(feature):
+                groups[val] = self.encoded.take(rows)
+            return goodness, groups
+
         phi_s = self.impurity_func(self.data)
-        values = list(np.unique(self.data[:, feature]))
 
-        total_rows = len(self.data)
+        total_rows = len(self.rows)
         summ_of_impurities = 0.0
-        for val in values:
-            groups[val] = self.data[self.data[:, feature] == val]
+        for val, rows in self._partition(feature):
+            groups[val] = self.encoded.take(rows)
             impurity = (groups[val].shape[0] / total_rows) * self.impurity_func(groups[val])
             summ_of_impurities += impurity
         goodness = phi_s - summ_of_impurities
@@ -219,7 +1189,95 @@ class DecisionNode:
         #                             END OF YOUR CODE                            #
         ###########################################################################
         return goodness, groups
+
+    def _partition(self, feature):
+        """
+        Group the node's instances by their value of the given feature (see
+        EncodedDataset.group_rows).
+
+        Returns:
+        - a list of (feature value, positions of the group's instances) pairs,
+          ordered by feature value.
+        """
+        kernel = _COUNT_KERNELS.get(self.impurity_func)
+        if feature in self.encoded.numeric and kernel is not None:
+            # Numeric features split in two at their best threshold
+            table = self.encoded.feature_contingency(self.rows, feature)
+            cut = self.encoded.best_cut(table, kernel, self.gain_ratio)
+            first = self.encoded.codes[self.rows, feature] <= cut
+            return list(zip(self._cut_values(feature, cut), (self.rows[first], self.rows[~first])))
+        grouped, present, bounds = self.encoded.group_rows(self.rows, feature)
+        vocab = self.encoded.vocabs[feature]
+        return [(vocab[code], grouped[start:stop]) for code, start, stop in zip(present, bounds[:-1], bounds[1:])]
+
+    def _cut_values(self, feature, cut):
+        """
+        The children values of a numeric split at a bin code: the intervals
+        (-inf, threshold] and (threshold, inf).
+        """
+        threshold = self.encoded.vocabs[feature][cut].right
+        return (pd.Interval(-np.inf, threshold, closed='right'),
+                pd.Interval(threshold, np.inf, closed='right'))
+
+    def _set_threshold(self, cut):
+        self.threshold_code = cut
+        self.threshold = self.encoded.vocabs[self.feature][cut].right
+
+    def _feature_scores(self, counts=None):
+        """
+        Calculate the goodness of split of every feature.
+
+        Impurity functions with a count based kernel are scored from a single
+        (feature value x class) contingency table, any other impurity function
+        falls back to goodness_of_split. Large nodes are scored by the node's
+        SplitExecutor, if any.
+
+        Input:
+        - counts: the node's contingency table, when the caller already counted it.
+        """
+        if self.split_cache is not None:
+            key = self.split_cache.key(self.encoded, self.rows, self.impurity_func, self.gain_ratio)
+            scores = self.split_cache.get(key)
+            if scores is not None:
+                return scores
+
+        kernel = _COUNT_KERNELS.get(self.impurity_func)
+        executor = self.split_executor
+        if kernel is None:
+            if executor is not None:
+                scores = np.array(executor.goodness(self), dtype=float)
+            else:
+                scores = np.array([self.goodness_of_split(feature)[0]
+                                   for feature in range(self.encoded.n_features)], dtype=float)
+        else:
+            if counts is None and executor is not None:
+                counts = executor.contingency(self.encoded, self.rows)
+            elif counts is None:
+                counts = self.encoded.contingency(self.rows)
+            scores = self.encoded.feature_scores(counts, kernel, self.gain_ratio)
+
+        if self.split_cache is not None:
+            self.split_cache.put(key, scores)
+        return scores
         
+    def _sample_features(self, scores):
+        """
+        Keep the scores of max_features features drawn at random, the others
+        can not be chosen (as in a random forest). When none of the drawn
+        features splits the node, features keep being drawn until one does.
+        All the scores are kept when max_features is None.
+        """
+        if self.max_features is None or self.max_features >= len(scores):
+            return scores
+        order = self.rng.permutation(len(scores))
+        positive = np.flatnonzero(scores[order] > 0)
+        n_drawn = self.max_features
+        if len(positive) > 0:
+            n_drawn = max(n_drawn, positive[0] + 1)
+        sampled = np.full(len(scores), -np.inf)
+        sampled[order[:n_drawn]] = scores[order[:n_drawn]]
+        return sampled
+
     def calc_feature_importance(self, n_total_sample):
         """
         Calculate the selected feature importance.
@@ -233,62 +1291,98 @@ class DecisionNode:
         ###########################################################################
         # TODO: Implement the function.                                           #
         ###########################################################################
-        total_rows = len(self.data)
-        goodness, _ = self.goodness_of_split(self.feature)
+        total_rows = int(self.class_counts.sum())
+        if self.goodness is not None and self.feature >= 0:
+            goodness = self.goodness # recorded when the node was split
+        else:
+            goodness, _ = self.goodness_of_split(self.feature)
         self.feature_importance = (total_rows / n_total_sample) * goodness
         ###########################################################################
         #                             END OF YOUR CODE                            #
         ###########################################################################
     
-    def split(self):
+    def split(self, scores=None):
         """
         Splits the current node according to the self.impurity_func. This function finds
         the best feature to split according to and create the corresponding children.
         This function should support pruning according to self.chi and self.max_depth.
 
+        Input:
+        - scores: the (sampled) goodness of split of every feature, if already
+                  calculated (see DecisionTree._grow_best_first).
+
         This function has no return value
         """
         ###########################################################################
         # TODO: Implement the function.                                           #
         ###########################################################################
 
-        # Find the maximal feature according to the goodness of split
-        max_goodness = -float('inf')
-        max_feature = None
-        max_feature_subset = None
-
-        n_features = self.data.shape[1] - 1  # Do not include the last column, which are the labels
+        stats = self.stats
+        if stats is not None:
+            lap = time.perf_counter()
 
-        for feature in range(n_features):
-            goodness, groups = self.goodness_of_split(feature)
-            if goodness > max_goodness:
-                max_goodness = goodness
-                max_feature = feature
-                max_feature_subset = groups
+        # Find the maximal feature according to the goodness of split
+        if scores is None:
+            scores = self._sample_features(self._feature_scores())
+        if stats is not None:
+            lap = stats.lap('impurity', lap)
+        if len(scores) == 0:
+            self.terminal = True
+            return
+        max_feature = int(np.argmax(scores))  # the first maximum, as with a strict '>' scan
+        max_goodness = scores[max_feature]
 
         if max_goodness <= 0 or self.depth >= self.max_depth:
             self.terminal = True
             return
 
-        if self.chi < 1.0:  # Only prune if chi pruning is active
-            n_classes = len(np.unique(self.data[:, -1]))
-            degrees_of_freedom = (len(max_feature_subset) - 1) * (n_classes - 1)
-            chi_square = self.compute_chi_square(max_feature_subset)
-            chi_threshold = chi_table[degrees_of_freedom][self.chi]
-
-            if chi_square < chi_threshold:
-                self.terminal = True
-                return
+        # Reorder the node's rows in place so every child owns a contiguous slice of them
+        max_feature_subset = {}
+        cut = None
+        if max_feature in self.encoded.numeric:
+            table = self.encoded.feature_contingency(self.rows, max_feature)
+            cut = self.encoded.best_cut(table, _COUNT_KERNELS[self.impurity_func], self.gain_ratio)
+            first = self.encoded.codes[self.rows, max_feature] <= cut
+            n_first = np.count_nonzero(first)
+            self.rows[:] = np.concatenate([self.rows[first], self.rows[~first]])
+            first_value, second_value = self._cut_values(max_feature, cut)
+            max_feature_subset[first_value] = self.rows[:n_first]
+            max_feature_subset[second_value] = self.rows[n_first:]
+        else:
+            grouped, present, bounds = self.encoded.group_rows(self.rows, max_feature)
+            self.rows[:] = grouped
+            for code, start, stop in zip(present, bounds[:-1], bounds[1:]):
+                max_feature_subset[self.encoded.vocabs[max_feature][code]] = self.rows[start:stop]
+        if stats is not None:
+            lap = stats.lap('partition', lap)
+
+        if cut is None:
+            table = self.encoded.feature_contingency(self.rows, max_feature)
+        else:
+            table = np.stack([table[:cut + 1].sum(axis=0), table[cut + 1:].sum(axis=0)])
+        pruned = self._chi_prunes(table[table.sum(axis=1) > 0])
+        if stats is not None:
+            lap = stats.lap('chi_square', lap)
+        if pruned:
+            self.terminal = True
+            return
 
         self.feature = max_feature
+        self.goodness = max_goodness
+        if cut is not None:
+            self._set_threshold(cut)
 
         # Create the nodes for each child (value) of the maximal feature
-        for val, subset in max_feature_subset.items():
+        for val, rows in max_feature_subset.items():
             child_node = DecisionNode(
-                subset, self.impurity_func, depth=self.depth + 1,
-                chi=self.chi, max_depth=self.max_depth, gain_ratio=self.gain_ratio
+                None, self.impurity_func, depth=self.depth + 1,
+                chi=self.chi, max_depth=self.max_depth, gain_ratio=self.gain_ratio,
+                encoded=self.encoded, rows=rows, split_cache=self.split_cache, stats=stats,
+                split_executor=self.split_executor, max_features=self.max_features, rng=self.rng
             )
             self.add_child(child_node, val)
+        if stats is not None:
+            stats.lap('node_creation', lap)
 
         # If no children, it's a leaf
         if len(self.children) == 0:
@@ -299,89 +1393,979 @@ class DecisionNode:
         Computes the chi-squared statistic between parent and children groups.
 
         Input:
-        - groups: dict mapping feature value -> subset of the data
+        - groups: dict mapping feature value -> the positions of the group's instances
+                  in the training data, or the group's subset of the data
 
         Output:
         - chi-square statistic (float)
         """
 
-        n_classes = len(np.unique(self.data[:, -1]))
-        df = (len(groups) - 1) * (n_classes - 1)
+        table = [self._group_class_counts(subset) for subset in groups.values()]
+        return chi_square_statistic(table)
+        ###########################################################################
+        #                             END OF YOUR CODE                            #
+        ###########################################################################
 
-        # Parent label distribution
-        labels = self.data[:, -1]
-        parent_counts = pd.Series(labels).value_counts().to_dict()
-        total_parent = len(labels)
+    def _group_class_counts(self, group):
+        """
+        Count the instances of every class in a group of compute_chi_square.
+        """
+        if group.ndim == 1:
+            return self.encoded.class_counts(group)
+        codes = pd.Categorical(group[:, -1], categories=self.encoded.vocabs[-1]).codes
+        return np.bincount(codes, minlength=self.encoded.n_classes)
 
-        chi_square = 0.0
+    def _chi_prunes(self, table):
+        """
+        Record the chi square statistic of the best split, so the tree can be
+        chi pruned later, and decide whether chi pruning stops the split.
 
-        for subset in groups.values():
-            subset_labels = subset[:, -1]
-            subset_counts = pd.Series(subset_labels).value_counts().to_dict()
-            total_subset = len(subset_labels)
+        Input:
+        - table: the (group x class) contingency table of the best split,
+                 one row per non empty group.
 
-            for label in parent_counts:
-                expected = (parent_counts[label] / total_parent) * total_subset
-                observed = subset_counts.get(label, 0)
-                if expected > 0:
-                    chi_square += (observed - expected) ** 2 / expected
+        Returns: True iff the node should stay a leaf.
+        """
+        n_classes = np.count_nonzero(self.class_counts)
+        self.degrees_of_freedom = (len(table) - 1) * (n_classes - 1)
+        self.chi_square = chi_square_statistic(table)
 
-        return chi_square
-        ###########################################################################
-        #                             END OF YOUR CODE                            #
-        ###########################################################################
+        if self.chi < 1.0:  # Only prune if chi pruning is active
+            return self.chi_square < chi_threshold(self.degrees_of_freedom, self.chi)
+        return False
+
+    def _split_from_counts(self, counts, scores=None):
+        """
+        Split the node like split does, but from the node's (feature value x class)
+        contingency table alone. The children are created without row positions,
+        holding only their class counts.
+
+        Input:
+        - counts: the node's contingency table, as returned by EncodedDataset.contingency.
+        - scores: the goodness of split of every feature, when already computed from counts.
+
+        This function has no return value
+        """
+        if scores is None:
+            kernel = _COUNT_KERNELS[self.impurity_func]
+            scores = self.encoded.feature_scores(counts, kernel, self.gain_ratio)
+        scores = self._sample_features(scores)
+        if len(scores) == 0:
+            self.terminal = True
+            return
+        max_feature = int(np.argmax(scores))
+        max_goodness = scores[max_feature]
+
+        if max_goodness <= 0 or self.depth >= self.max_depth:
+            self.terminal = True
+            return
+
+        stats = self.stats
+        if stats is not None:
+            lap = time.perf_counter()
+        block = self.encoded.feature_block(counts, max_feature)
+        cut = None
+        if max_feature in self.encoded.numeric:
+            cut = self.encoded.best_cut(block, _COUNT_KERNELS[self.impurity_func], self.gain_ratio)
+            block = np.stack([block[:cut + 1].sum(axis=0), block[cut + 1:].sum(axis=0)])
+            values = self._cut_values(max_feature, cut)
+        else:
+            values = self.encoded.vocabs[max_feature]
+        present = np.flatnonzero(block.sum(axis=1))
+        pruned = self._chi_prunes(block[present])
+        if stats is not None:
+            lap = stats.lap('chi_square', lap)
+        if pruned:
+            self.terminal = True
+            return
+
+        self.feature = max_feature
+        self.goodness = max_goodness
+        if cut is not None:
+            self._set_threshold(cut)
+        for code in present:
+            child_node = DecisionNode(
+                None, self.impurity_func, depth=self.depth + 1,
+                chi=self.chi, max_depth=self.max_depth, gain_ratio=self.gain_ratio,
+                encoded=self.encoded, split_cache=self.split_cache, class_counts=block[code],
+                stats=stats, max_features=self.max_features, rng=self.rng
+            )
+            self.add_child(child_node, values[code])
+        if stats is not None:
+            stats.lap('node_creation', lap)
+
+
+class CompiledTree:
+    """
+    A built decision tree flattened into parallel NumPy arrays, used to route
+    whole batches of instances at once.
+
+    Nodes are numbered in breadth first order, the root being node 0. The
+    children of an internal node i are found in
+    child_table[child_offset[i] + code], where code is the encoded value of
+    feature[i] and -1 marks a value without a child (unknown values stop the
+    routing at the current node, like DecisionTree.predict does).
+    """
+
+    def __init__(self, feature, child_offset, child_table, pred, vocabs, importance=None):
+        self.feature = feature # the feature index used by each node, -1 for leaves
+        self.child_offset = child_offset # the start of each node's block in child_table
+        self.child_table = child_table # encoded feature value -> child node index
+        self.pred = pred # the encoded class prediction of each node
+        self.vocabs = vocabs # the vocabularies of the features and (last) of the labels
+        self.importance = importance # the feature importance of each node, if known
+        self._lookups = None # the _column_lookups of vocabs, built on the first encoding
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def lookups(self):
+        if self._lookups is None:
+            self._lookups = _column_lookups(self.vocabs)
+        return self._lookups
+
+    def apply(self, codes):
+        """
+        Route encoded instances down the tree, one depth level per iteration.
+
+        Input:
+        - codes: the output of _encode_columns for the instances.
+
+        Output: the index of the node each instance stops at.
+        """
+        nodes = np.zeros(len(codes), dtype=np.intp)
+        active = np.arange(len(codes)) if self.feature[0] >= 0 else np.empty(0, dtype=np.intp)
+        while len(active) > 0:
+            current = nodes[active]
+            values = codes[active, self.feature[current]]
+            known = values >= 0
+            children = np.full(len(active), -1, dtype=np.intp)
+            children[known] = self.child_table[self.child_offset[current[known]] + values[known]]
+            moved = children >= 0
+            active = active[moved]
+            nodes[active] = children[moved]
+            active = active[self.feature[nodes[active]] >= 0]
+        return nodes
+
+    def predict_batch(self, X):
+        """
+        Predict a batch of instances.
+
+        Input:
+        - X: a 2D array of instances, optionally with the labels in the last
+             column, or an EncodedDataset.
+
+        Output: an array with the prediction of every instance.
+        """
+        return self.vocabs[-1][self.pred[self.apply(self.encode(X))]]
+
+    def encode(self, X, labels=False):
+        """
+        Encode instances with the tree's vocabularies.
+
+        Input:
+        - X: a 2D array of instances or an EncodedDataset.
+        - labels: True to encode the labels (the last column) as well.
+
+        Output: the codes of the instances, -1 marking unknown values.
+        """
+        vocabs = self.vocabs if labels else self.vocabs[:-1]
+        if isinstance(X, EncodedDataset):
+            return _translate_codes(X, vocabs, lookups=self.lookups[:len(vocabs)])
+        return _encode_columns(X, vocabs, self.lookups[:len(vocabs)])
+
+    def evaluate(self, X, chunksize=None):
+        """
+        Evaluate the tree on labeled instances, one chunk of instances at a
+        time so test sets larger than memory can be evaluated.
+
+        Input:
+        - X: the instances with their labels in the last column: a 2D array
+             (possibly memory-mapped), an EncodedDataset, or an iterable of
+             such chunks (e.g. arrays or the DataFrames of pd.read_csv with chunksize).
+        - chunksize: the number of instances of X encoded and routed at a time
+                     (default: all of them).
+
+        Output: an Evaluation.
+        """
+        evaluation = Evaluation(self)
+        if isinstance(X, (np.ndarray, EncodedDataset, pd.DataFrame)):
+            X = [X]
+        for chunk in X:
+            if isinstance(chunk, pd.DataFrame):
+                chunk = chunk.to_numpy()
+            step = chunksize or max(len(chunk), 1)
+            for start in range(0, len(chunk), step):
+                if isinstance(chunk, EncodedDataset):
+                    codes = _translate_codes(chunk, self.vocabs, slice(start, start + step), self.lookups)
+                else:
+                    codes = _encode_columns(chunk[start:start + step], self.vocabs, self.lookups)
+                evaluation.add(codes)
+        return evaluation
+
+    def save(self, path):
+        """
+        Write the tree to a compact binary model file holding only its arrays
+        and vocabularies (no training data). See load_model.
+
+        Input:
+        - path: the file to write. The vocabularies must be JSON serializable.
+
+        This function has no return value
+        """
+        arrays = {'feature': self.feature, 'child_offset': self.child_offset,
+                  'child_table': self.child_table, 'pred': self.pred}
+        # Node numbers, table offsets and codes all fit 32 bits for any practical tree
+        arrays = {name: array.astype(np.int32) for name, array in arrays.items()}
+        if self.importance is not None:
+            arrays['importance'] = np.asarray(self.importance, dtype=float)
+        _write_binary(path, {'kind': 'tree', 'vocabs': _json_vocabs(self.vocabs)}, arrays)
+
+    def predictor_source(self, name='predict', max_nesting=12):
+        """
+        Generate the source of a standalone Python module predicting a single
+        instance from its raw feature values, importing neither NumPy nor pandas.
+
+        Every internal node becomes a chain of tests on its feature's value
+        (set membership for the values sharing a child, a comparison with the
+        threshold for a numeric feature) and the leaves' predictions are
+        inlined. An unknown value returns the prediction of the current node,
+        like DecisionTree.predict, so subtrees always predicting the same as
+        their parent need no test. Subtrees deeper than max_nesting levels are moved
+        into helper functions.
+
+        Input:
+        - name: the name of the generated function, called as name(instance).
+        - max_nesting: the maximal number of tree levels nested in one function.
+
+        Output: the source of the module.
+        """
+        lines = ['"""',
+                 'Generated by hw2.py from a decision tree of {} nodes.'.format(self.n_nodes),
+                 '',
+                 '{}(x) predicts an instance x, a sequence of raw feature values'.format(name),
+                 'optionally holding its label last.',
+                 '"""']
+        constant = self._constant_subtrees()
+        functions = deque([(name, 0)]) # (function name, node) of the functions to generate
+
+        def emit(node, indent, level):
+            pad = '    ' * indent
+            pred = self.pred[node]
+            feature = self.feature[node]
+            if constant[node] >= 0:
+                lines.append(pad + 'return ' + _py_literal(self.vocabs[-1][pred]))
+                return
+            if level >= max_nesting:
+                helper = '_{}_{}'.format(name, node)
+                functions.append((helper, node))
+                lines.append(pad + 'return {}(x)'.format(helper))
+                return
+            vocab = self.vocabs[feature]
+            block = self.child_table[self.child_offset[node]:self.child_offset[node] + len(vocab)]
+            if _is_binned(vocab):
+                cut = int(np.flatnonzero(block == block[0])[-1])
+                lines.append(pad + 'if float(x[{}]) <= {!r}:'.format(feature, float(vocab[cut].right)))
+                emit(int(block[0]), indent + 1, level + 1)
+                emit(int(block[-1]), indent, level + 1)
+                return
+
+            # Constant children are grouped by prediction, the other children get a test each
+            groups = OrderedDict()
+            for code, child in enumerate(block):
+                if child < 0:
+                    continue
+                if constant[child] >= 0:
+                    if constant[child] == pred:
+                        continue # same as the fallback
+                    key = ('leaf', int(constant[child]))
+                else:
+                    key = ('node', int(child))
+                groups.setdefault(key, []).append(_py_literal(vocab[code]))
+            if groups:
+                lines.append(pad + 'value = x[{}]'.format(feature))
+            for (kind, target), values in groups.items():
+                if len(values) == 1:
+                    lines.append(pad + 'if value == {}:'.format(values[0]))
+                else:
+                    lines.append(pad + 'if value in {{{}}}:'.format(', '.join(values)))
+                if kind == 'leaf':
+                    lines.append(pad + '    return ' + _py_literal(self.vocabs[-1][target]))
+                else:
+                    emit(target, indent + 1, level + 1)
+            lines.append(pad + 'return ' + _py_literal(self.vocabs[-1][pred]))
+
+        while functions:
+            function, node = functions.popleft()
+            lines += ['', '', 'def {}(x):'.format(function)]
+            emit(node, 1, 0)
+        return '\n'.join(lines) + '\n'
+
+    def _constant_subtrees(self):
+        """
+        The prediction of every subtree predicting the same whatever the
+        instance, -1 for the others.
+        """
+        constant = np.array(self.pred, dtype=np.intp)
+        for node in range(self.n_nodes - 1, -1, -1): # children come after their parents
+            feature = self.feature[node]
+            if feature < 0:
+                continue
+            start = self.child_offset[node]
+            children = self.child_table[start:start + len(self.vocabs[feature])]
+            if np.any(constant[children[children >= 0]] != constant[node]):
+                constant[node] = -1
+        return constant
+
+    def predictor(self, name='predict', max_nesting=12):
+        """
+        Compile the generated single instance predictor (see predictor_source).
+
+        Output: the function, predicting exactly like DecisionTree.predict.
+        """
+        namespace = {}
+        exec(compile(self.predictor_source(name, max_nesting), '<{}>'.format(name), 'exec'), namespace)
+        return namespace[name]
+
+    def export_predictor(self, path, name='predict', max_nesting=12):
+        """
+        Write the generated single instance predictor to a Python module
+        (see predictor_source), importable without hw2.py, NumPy or pandas.
+
+        This function has no return value
+        """
+        with open(path, 'w') as f:
+            f.write(self.predictor_source(name, max_nesting))
+
+
+class Evaluation:
+    """
+    The evaluation of a compiled tree on labeled instances, accumulated over
+    batches of encoded instances: the confusion matrix, from which accuracy,
+    precision and recall follow, and the number of instances (and of correct
+    predictions) at every node routing stops at.
+    """
+
+    def __init__(self, compiled):
+        self.compiled = compiled # the evaluated CompiledTree
+        n_classes = len(compiled.vocabs[-1])
+        self.confusion = np.zeros((n_classes, n_classes), dtype=np.int64) # confusion[true code, predicted code]
+        self.unknown_labels = 0 # instances whose label the tree never saw (always mispredicted)
+        self.leaf_hits = np.zeros(compiled.n_nodes, dtype=np.int64) # instances stopping at every node
+        self.leaf_correct = np.zeros(compiled.n_nodes, dtype=np.int64) # correct predictions at every node
+
+    @property
+    def classes(self):
+        return self.compiled.vocabs[-1]
+
+    @property
+    def n_instances(self):
+        return int(self.confusion.sum()) + self.unknown_labels
+
+    @property
+    def n_correct(self):
+        return int(np.trace(self.confusion))
+
+    @property
+    def accuracy(self):
+        """
+        The accuracy of the tree (%).
+        """
+        return self.n_correct / self.n_instances * 100
+
+    @property
+    def precision(self):
+        """
+        The precision of every class (0 for classes never predicted).
+        """
+        predicted = self.confusion.sum(axis=0)
+        return np.divide(np.diag(self.confusion), predicted, out=np.zeros(len(predicted)), where=predicted > 0)
+
+    @property
+    def recall(self):
+        """
+        The recall of every class (0 for classes absent from the instances).
+        """
+        actual = self.confusion.sum(axis=1)
+        return np.divide(np.diag(self.confusion), actual, out=np.zeros(len(actual)), where=actual > 0)
+
+    def add(self, codes):
+        """
+        Add a batch of instances, encoded with the tree's vocabularies and
+        with their encoded labels in the last column.
+        """
+        nodes = self.compiled.apply(codes)
+        predictions = self.compiled.pred[nodes]
+        labels = codes[:, -1].astype(np.intp)
+        known = labels >= 0
+        n_classes = len(self.confusion)
+        self.confusion += np.bincount(labels[known] * n_classes + predictions[known],
+                                      minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+        self.unknown_labels += int(np.count_nonzero(~known))
+        self.leaf_hits += np.bincount(nodes, minlength=self.compiled.n_nodes)
+        self.leaf_correct += np.bincount(nodes[predictions == labels], minlength=self.compiled.n_nodes)
+
+    def summary(self):
+        return {'n_instances': self.n_instances,
+                'accuracy': self.accuracy,
+                'precision': dict(zip(self.classes.tolist(), self.precision.tolist())),
+                'recall': dict(zip(self.classes.tolist(), self.recall.tolist())),
+                'unknown_labels': self.unknown_labels}
+
+    def __repr__(self):
+        return 'Evaluation({})'.format(self.summary())
 
                     
+# The maximal number of (node, feature value, class) counters a level-wise
+# growth holds at once; larger frontiers are counted in batches
+_LEVEL_BATCH_CELLS = 1 << 24
+
+
+def _n_candidate_features(max_features, n_features):
+    """
+    Resolve the max_features of a DecisionTree into a number of features, None meaning all of them.
+    """
+    if max_features is None:
+        return None
+    if max_features == 'sqrt':
+        count = np.sqrt(n_features)
+    elif max_features == 'log2':
+        count = np.log2(max(n_features, 1))
+    elif isinstance(max_features, float):
+        count = max_features * n_features
+    else:
+        count = max_features
+    return max(1, int(count))
+
+
+def _split_importance(node, n_total):
+    """
+    The importance of a node's split, (node_rows / n_total) * goodness, 0 for leaves.
+    """
+    if node.terminal or len(node.children) == 0 or node.goodness is None:
+        return 0
+    return (int(node.class_counts.sum()) / n_total) * node.goodness
+
+
 class DecisionTree:
-    def __init__(self, data, impurity_func, feature=-1, chi=1, max_depth=1000, gain_ratio=False):
-        self.data = data # the training data used to construct the tree
+    def __init__(self, data, impurity_func, feature=-1, chi=1, max_depth=1000, gain_ratio=False,
+                 split_cache=None, growth='node', n_jobs=1, parallel_min_rows=_PARALLEL_SPLIT_MIN_ROWS,
+                 max_features=None, seed=None, numeric_features=(), max_bins=256,
+                 max_leaf_nodes=None, min_gain=0.0):
+        self.data = data # the training data used to construct the tree (raw or an EncodedDataset)
         self.root = None # the root node of the tree
+        self.encoded = None # the integer encoding of the training data, created by build_tree
         self.max_depth = max_depth # the maximum allowed depth of the tree
         self.chi = chi # the P-value cutoff used for chi square pruning
         self.impurity_func = impurity_func # the impurity function to be used in the tree
         self.gain_ratio = gain_ratio #
+        self.compiled = None # the flat array form of the tree, created by compile
+        self.split_cache = split_cache # a SplitCache to share split statistics with other trees
+        self.growth = growth # 'node' splits one node at a time, 'level' a whole depth level at a time,
+                             # 'best' the node with the largest weighted gain first
+        self.build_stats = None # the BuildStats of the last instrumented build
+        self.n_jobs = n_jobs # threads scoring the features of large nodes (None: one per CPU, 1: serial)
+        self.parallel_min_rows = parallel_min_rows # the minimal number of instances of a node scored in parallel
+        self.max_features = max_features # features drawn as split candidates per node: int, fraction, 'sqrt', 'log2' or None (all)
+        self.seed = seed # the seed of the candidate feature draws
+        self.numeric_features = numeric_features # the columns of raw data binned as numeric features
+        self.max_bins = max_bins # the maximal number of bins of a numeric feature
+        self.max_leaf_nodes = max_leaf_nodes # the maximal number of leaves of a best-first tree (None: unlimited)
+        self.min_gain = min_gain # the minimal weighted gain of a best-first split
         
     def depth(self):
         return self.root.depth
 
-    def build_tree(self):
+    def release_data(self):
+        """
+        Drop every reference to the training instances from the built tree.
+        The tree keeps its split structure and the nodes' predictions, so it
+        can still predict, but the nodes no longer expose their data.
+
+        This function has no return value
+        """
+        self.data = None
+        self.encoded = self.encoded.strip()
+        queue = deque([self.root])
+        while queue:
+            node = queue.popleft()
+            node.rows = None
+            node.encoded = self.encoded
+            queue.extend(node.children)
+
+    def build_tree(self, instrument=False, callback=None):
         """
         Build a tree using the given impurity measure and training dataset. 
         You are required to fully grow the tree until all leaves are pure 
         or the goodness of split is 0.
 
-        This function has no return value
+        Input:
+        - instrument: True to measure the build (see BuildStats).
+        - callback: called as callback(node, stats) after every node split,
+                    implies instrument.
+
+        Output: the BuildStats of an instrumented build (also kept in
+                self.build_stats), None otherwise.
         """
         self.root = None
+        self.compiled = None
+        self.build_stats = BuildStats(callback) if instrument or callback is not None else None
         ###########################################################################
         # TODO: Implement the function.                                           #
         ###########################################################################
+        if isinstance(self.data, EncodedDataset):
+            self.encoded = self.data
+        else:
+            self.encoded = EncodedDataset(self.data, numeric=self.numeric_features, max_bins=self.max_bins)
+        if self.encoded.numeric and self.impurity_func not in _COUNT_KERNELS:
+            raise ValueError("Numeric features require a count based impurity function")
         self.root = DecisionNode(
-            self.data,
+            None,
             impurity_func=self.impurity_func,
             max_depth=self.max_depth,
             chi=self.chi,
-            gain_ratio=self.gain_ratio
+            gain_ratio=self.gain_ratio,
+            encoded=self.encoded,
+            rows=np.arange(len(self.encoded.codes)),
+            split_cache=self.split_cache,
+            stats=self.build_stats,
+            max_features=_n_candidate_features(self.max_features, self.encoded.n_features),
+            rng=np.random.default_rng(self.seed)
         )
-        queue = deque([self.root]) # initialize queue with root node
-        import time
+        if self.growth == 'level':
+            self._grow_level_wise()
+        elif self.growth in ('node', 'best'):
+            if self.n_jobs != 1:
+                self.root.split_executor = SplitExecutor(self.n_jobs, self.parallel_min_rows)
+            try:
+                if self.growth == 'best':
+                    self._grow_best_first()
+                else:
+                    queue = deque([self.root]) # initialize queue with root node
+                    while len(queue) > 0:
+                        node = queue.popleft()
+                        node.split()
+                        for child in node.children:
+                            queue.append(child)
+                        if self.build_stats is not None:
+                            self.build_stats.node_done(node, len(queue))
+            finally:
+                if self.root.split_executor is not None:
+                    self.root.split_executor.shutdown()
+        else:
+            raise ValueError("Unknown growth mode: {}".format(self.growth))
+        ###########################################################################
+        #                             END OF YOUR CODE                            #
+        ###########################################################################
+        if self.build_stats is not None:
+            self.build_stats.finish(self)
+        return self.build_stats
 
-        count = 0
-        start = time.time()
+    def _grow_best_first(self):
+        """
+        Grow the tree from its root by always splitting the frontier node with
+        the largest weighted gain, (node_rows / n_total) * goodness, until
+        max_leaf_nodes leaves exist or no frontier node gains min_gain.
+
+        With a count based impurity function and without gain ratio, a node's
+        impurity bounds its goodness, so new nodes enter the frontier with
+        the bound (node_rows / n_total) * impurity and their features are only
+        scored once the bound reaches the top of the frontier: nodes left
+        behind by the leaf budget are never scored. When the split of the top
+        node would exceed the budget, the node goes back to the frontier with
+        its best feature having few enough values, if any, and stays a leaf
+        otherwise. Without a budget or minimal gain the tree is the same as
+        the one grown node by node, except with max_features: the features of
+        the nodes are drawn in the order the nodes are scored, which is not
+        breadth first, so the random draws go to other nodes.
 
-        while len(queue) > 0:
-            node = queue.popleft()
-            node.split()
+        This function has no return value
+        """
+        encoded = self.encoded
+        stats = self.build_stats
+        kernel = _COUNT_KERNELS.get(self.impurity_func)
+        bounded = kernel is not None and not self.gain_ratio
+        n_total = int(self.root.class_counts.sum())
+        frontier = [] # heap of (-weighted gain or bound, insertion order, node, scores or None for a bound, n_children)
+        order = 0
+
+        def leaf(node):
+            node.terminal = True
+            if stats is not None:
+                stats.node_done(node, len(frontier))
+
+        def push(node, gain, scores, n_children=None):
+            nonlocal order
+            if gain <= 0 or gain < self.min_gain:
+                leaf(node)
+                return
+            heapq.heappush(frontier, (-gain, order, node, scores, n_children))
+            order += 1
+
+        def score(node):
+            if stats is not None:
+                lap = time.perf_counter()
+            n_children = None
+            if self.max_leaf_nodes is None:
+                scores = node._feature_scores()
+            else:
+                # The number of children a split on every feature creates, from the table scored
+                executor = node.split_executor
+                counts = executor.contingency(encoded, node.rows) if executor is not None else encoded.contingency(node.rows)
+                scores = node._feature_scores(counts)
+                present = counts.sum(axis=1) > 0
+                n_children = np.add.reduceat(present.astype(np.intp), encoded.offsets)
+                n_children[encoded.numeric] = 2
+            scores = node._sample_features(scores)
+            if stats is not None:
+                stats.lap('impurity', lap)
+            gain = 0.0 if len(scores) == 0 else (int(node.class_counts.sum()) / n_total) * np.max(scores)
+            push(node, gain, scores, n_children)
+
+        def enter(node):
+            if node.depth >= node.max_depth:
+                leaf(node)
+            elif bounded:
+                push(node, (int(node.class_counts.sum()) / n_total) * float(kernel(node.class_counts)), None)
+            else:
+                score(node)
+
+        enter(self.root)
+        n_leaves = 1
+        while frontier and (self.max_leaf_nodes is None or n_leaves < self.max_leaf_nodes):
+            _, _, node, scores, n_children = heapq.heappop(frontier)
+            if scores is None:
+                score(node)
+                continue
+            if self.max_leaf_nodes is not None:
+                if n_leaves + n_children[int(np.argmax(scores))] - 1 > self.max_leaf_nodes:
+                    scores = np.where(n_leaves + n_children - 1 <= self.max_leaf_nodes, scores, -np.inf)
+                    push(node, (int(node.class_counts.sum()) / n_total) * np.max(scores), scores, n_children)
+                    continue
+            node.split(scores)
+            if len(node.children) > 0:
+                n_leaves += len(node.children) - 1
+            if stats is not None:
+                stats.node_done(node, len(frontier))
             for child in node.children:
-                queue.append(child)
-            count += 1
+                enter(child)
+        while frontier:
+            leaf(heapq.heappop(frontier)[2])
 
-            if count % 500 == 0:
-                elapsed = time.time() - start
-                print(f"Processed {count} nodes in {elapsed:.1f}s; queue size = {len(queue)}")
-        ###########################################################################
-        #                             END OF YOUR CODE                            #
-        ###########################################################################
+    def _grow_level_wise(self):
+        """
+        Grow the tree from its root one depth level at a time. The contingency
+        tables of all the nodes of a level are counted together in one pass
+        over their rows, grouped by node, then every node of the level is split
+        from its table and the rows of the split nodes are partitioned in one
+        stable sort. The tree is the same as the one grown node by node.
+
+        This function has no return value
+        """
+        if self.impurity_func not in _COUNT_KERNELS:
+            raise ValueError("Level-wise growth requires a count based impurity function")
+        encoded = self.encoded
+        stats = self.build_stats
+        n_cells = encoded.n_bins * encoded.n_classes
+        batch_size = max(1, _LEVEL_BATCH_CELLS // max(n_cells, 1))
+
+        frontier = [self.root]
+        while len(frontier) > 0:
+            next_frontier = []
+            for start in range(0, len(frontier), batch_size):
+                if stats is not None:
+                    lap = time.perf_counter()
+                batch = frontier[start:start + batch_size]
+                sizes = np.array([len(node.rows) for node in batch])
+                rows = np.concatenate([node.rows for node in batch])
+                positions = np.repeat(np.arange(len(batch)), sizes)
+
+                # Count the (node, feature value, class) co-occurrences of the batch at once
+                codes = encoded.codes[rows]
+                bins = codes[:, :-1].astype(np.intp) + encoded.offsets
+                flat = positions[:, None] * n_cells + bins * encoded.n_classes + codes[:, -1:].astype(np.intp)
+                counts = np.bincount(flat.reshape(-1), minlength=len(batch) * n_cells)
+                counts = counts.reshape(len(batch), encoded.n_bins, encoded.n_classes)
+                scores = encoded.feature_scores(counts, _COUNT_KERNELS[self.impurity_func], self.gain_ratio)
+                if stats is not None:
+                    stats.lap('impurity', lap)
+                for node, node_counts, node_scores in zip(batch, counts, scores):
+                    node._split_from_counts(node_counts, node_scores)
+                if stats is not None:
+                    lap = time.perf_counter()
+
+                # Partition the rows of the split nodes by (node, value of the node's feature)
+                features = np.array([node.feature if len(node.children) > 0 else 0 for node in batch])
+                cuts = np.array([-1 if node.threshold_code is None else node.threshold_code for node in batch])
+                values = codes[np.arange(len(rows)), features[positions]].astype(np.intp)
+                # Numeric splits send the codes above the threshold to the second child
+                values = np.where(cuts[positions] >= 0, values > cuts[positions], values)
+                keys = positions * (encoded.n_values.max() + 1) + values
+                order = np.argsort(keys, kind='stable')
+                rows = rows[order]
+                ends = np.cumsum(sizes)
+                for node, end, size in zip(batch, ends, sizes):
+                    if len(node.children) == 0:
+                        continue
+                    node.rows[:] = rows[end - size:end]
+                    child_sizes = [child.class_counts.sum() for child in node.children]
+                    child_start = 0
+                    for child, child_size in zip(node.children, child_sizes):
+                        child.rows = node.rows[child_start:child_start + child_size]
+                        child_start += child_size
+                    next_frontier.extend(node.children)
+                if stats is not None:
+                    stats.lap('partition', lap)
+                    waiting = len(frontier) - start + len(next_frontier)
+                    for node in batch:
+                        waiting -= 1
+                        stats.node_done(node, waiting)
+            frontier = next_frontier
+
+    def build_tree_from_csv(self, path, chunksize=100000, **read_csv_kwargs):
+        """
+        Build the tree from a CSV file without loading it into memory. The file
+        is read in chunks, once to collect the values of every column and then
+        once per depth level: each pass routes the rows to the nodes of the
+        level and accumulates their (feature value x class) counts, from which
+        all the nodes of the level are split. The resulting tree is the one
+        build_tree gives on the same data, but holds no training instances.
+        The columns of self.numeric_features are binned from the value counts
+        of the first pass.
+
+        Input:
+        - path: the CSV file, where the last column holds the labels.
+        - chunksize: the number of rows read at a time.
+        - read_csv_kwargs: extra arguments for pd.read_csv. Values are read as
+                           strings by default.
+
+        This function has no return value
+        """
+        if self.impurity_func not in _COUNT_KERNELS:
+            raise ValueError("Training from a CSV requires a count based impurity function")
+        read_csv_kwargs.setdefault('dtype', str)
+        read_csv_kwargs.setdefault('keep_default_na', False)
+
+        def chunks():
+            for chunk in pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs):
+                yield chunk.to_numpy()
+
+        values = None
+        value_counts = {col: pd.Series(dtype=np.int64) for col in self.numeric_features}
+        for chunk in chunks():
+            chunk_values = [np.unique(chunk[:, col]) for col in range(chunk.shape[1])]
+            if values is None:
+                values = chunk_values
+            else:
+                values = [np.union1d(a, b) for a, b in zip(values, chunk_values)]
+            for col in self.numeric_features:
+                counts = pd.Series(chunk[:, col].astype(float)).value_counts()
+                value_counts[col] = value_counts[col].add(counts, fill_value=0)
+        vocabs = [np.asarray(vocab, dtype=object) for vocab in values]
+        for col, counts in value_counts.items():
+            counts = counts.sort_index()
+            vocabs[col] = _interval_vocab(_bin_edges(counts.index.to_numpy(), counts.to_numpy(), self.max_bins))
+        self.data = None
+        self.compiled = None
+        self.encoded = EncodedDataset(None, codes=np.empty((0, len(vocabs)), dtype=np.intp), vocabs=vocabs)
+
+        self.root = DecisionNode(
+            None,
+            impurity_func=self.impurity_func,
+            max_depth=self.max_depth,
+            chi=self.chi,
+            gain_ratio=self.gain_ratio,
+            encoded=self.encoded,
+            class_counts=np.zeros(self.encoded.n_classes, dtype=np.int64)
+        )
+
+        n_cells = self.encoded.n_bins * self.encoded.n_classes
+        frontier = [self.root]
+        while len(frontier) > 0:
+            # Map the node numbers of the compiled tree to positions in the frontier
+            self.compiled = None
+            frontier_index = np.full(self.compile().n_nodes, -1, dtype=np.intp)
+            positions = {id(node): i for i, node in enumerate(frontier)}
+            queue = deque([self.root])
+            number = 0
+            while queue:
+                node = queue.popleft()
+                frontier_index[number] = positions.get(id(node), -1)
+                number += 1
+                queue.extend(node.children)
+
+            counts = np.zeros((len(frontier), n_cells), dtype=np.int64)
+            for chunk in chunks():
+                codes = _encode_columns(chunk, vocabs)
+                nodes = frontier_index[self.compiled.apply(codes)]
+                codes = codes[nodes >= 0]
+                nodes = nodes[nodes >= 0]
+                bins = codes[:, :-1] + self.encoded.offsets
+                flat = nodes[:, None] * n_cells + bins * self.encoded.n_classes + codes[:, -1:]
+                counts += np.bincount(flat.reshape(-1), minlength=counts.size).reshape(counts.shape)
+            counts = counts.reshape(len(frontier), self.encoded.n_bins, self.encoded.n_classes)
+
+            next_frontier = []
+            for node, node_counts in zip(frontier, counts):
+                node.class_counts = node_counts[:self.encoded.n_values[0]].sum(axis=0)
+                node.pred = node.calc_node_pred()
+                node._split_from_counts(node_counts)
+                next_frontier.extend(node.children)
+            frontier = next_frontier
+        self.compiled = None
+
+    def update(self, rows, delta=None):
+        """
+        Learn from new labeled instances without rebuilding the tree. The new
+        instances are routed down the tree, updating the class counts and the
+        predictions of the nodes they reach, and the split of every reached
+        node is re-evaluated from its (feature value x class) counts, which
+        are kept on the nodes between updates. Only the subtrees whose split
+        changed are grown again. Values and labels never seen before extend
+        the vocabularies of the tree.
+
+        Input:
+        - rows: the new instances, with the labels in the last column (may be an EncodedDataset).
+        - delta: None to re-evaluate the splits exactly, so the tree is the one
+                 build_tree gives on all the instances. Otherwise the Hoeffding
+                 bound confidence: a node only changes its split feature when a
+                 feature beats it by more than R * sqrt(ln(1/delta) / (2n)),
+                 where n is the node's number of instances and R the range of
+                 the goodness of split.
+
+        Output: the number of subtrees that were grown again.
+        """
+        if self.root is None:
+            raise ValueError("The tree must be built before it is updated")
+        if self.encoded.codes is None or self.root.rows is None:
+            raise ValueError("Updating a tree requires its training instances "
+                             "(the tree released them or was trained from counts)")
+        kernel = _COUNT_KERNELS.get(self.impurity_func)
+        if kernel is None:
+            raise ValueError("Updating a tree requires a count based impurity function")
+
+        # Extend the encoding with the new instances
+        old = self.encoded
+        if isinstance(rows, EncodedDataset):
+            new_vocabs = rows.vocabs
+        else:
+            rows = np.asarray(rows, dtype=object)
+            new_vocabs = [rows[:, col] for col in range(rows.shape[1])]
+        # Numeric features keep their bins, which cover every value
+        vocabs = [vocab if _is_binned(vocab) else np.union1d(vocab, new_vocab)
+                  for vocab, new_vocab in zip(old.vocabs, new_vocabs)]
+        vocabs_changed = not all(np.array_equal(a, b) for a, b in zip(old.vocabs, vocabs))
+        if isinstance(rows, EncodedDataset):
+            new_codes = _translate_codes(rows, vocabs)
+            raw = None
+        else:
+            new_codes = _encode_columns(rows, vocabs)
+            raw = None if old.data is None else np.concatenate([old.data, rows])
+        if (new_codes < 0).any():
+            raise ValueError("The new instances are binned differently from the tree's numeric features")
+        codes = np.concatenate([_translate_codes(old, vocabs), new_codes])
+        self.encoded = EncodedDataset(raw, codes=codes, vocabs=vocabs)
+        self.data = raw if raw is not None else self.encoded
+        self.compiled = None
+        encoded = self.encoded
+        class_table = pd.Index(vocabs[-1]).get_indexer(old.vocabs[-1])
+
+        # Route the new instances down the tree and lay out the rows of every
+        # node as a slice of one array, children first and in order
+        order = np.empty(len(encoded), dtype=np.intp)
+        reached = [] # (node, positions of the new instances reaching it)
+        stray = {} # id(node) -> True iff new instances stopped at the split node on unknown values
+        queue = deque([(self.root, np.arange(len(old), len(encoded)), 0)])
+        while queue:
+            node, new_rows, start = queue.popleft()
+            node.encoded = encoded
+            if vocabs_changed:
+                class_counts = np.zeros(encoded.n_classes, dtype=np.int64)
+                class_counts[class_table] = node.class_counts
+                node.class_counts = class_counts
+                node.split_counts = None
+            if len(new_rows) > 0:
+                node.class_counts = node.class_counts + np.bincount(encoded.codes[new_rows, -1],
+                                                                    minlength=encoded.n_classes)
+                node.pred = node.calc_node_pred()
+                if node.split_counts is not None:
+                    node.split_counts = node.split_counts + encoded.contingency(new_rows)
+                reached.append((node, new_rows))
+            old_rows = node.rows
+            node.rows = order[start:start + int(node.class_counts.sum())]
+            if len(node.children) == 0:
+                node.rows[:len(old_rows)] = old_rows
+                node.rows[len(old_rows):] = new_rows
+                continue
+            values = encoded.codes[new_rows, node.feature]
+            if node.threshold_code is not None:
+                masks = [values <= node.threshold_code, values > node.threshold_code]
+            else:
+                masks = [values == code for code in pd.Index(vocabs[node.feature]).get_indexer(node.children_values)]
+            routed = np.zeros(len(new_rows), dtype=bool)
+            for child, mask in zip(node.children, masks):
+                routed |= mask
+                queue.append((child, new_rows[mask], start))
+                start += int(child.class_counts.sum()) + np.count_nonzero(mask)
+            node.rows[len(node.rows) - np.count_nonzero(~routed):] = new_rows[~routed]
+            stray[id(node)] = not routed.all()
+
+        # Re-evaluate the splits of the reached nodes, from the root down
+        if self.gain_ratio:
+            goodness_range = 1.0
+        else:
+            goodness_range = float(kernel(np.ones(encoded.n_classes)))
+        reached_rows = {id(node): new_rows for node, new_rows in reached}
+        regrown = 0
+        queue = deque([self.root] if len(reached) > 0 else [])
+        while queue:
+            node = queue.popleft()
+            if node.split_counts is None:
+                node.split_counts = encoded.contingency(node.rows)
+            scores = encoded.feature_scores(node.split_counts, kernel, self.gain_ratio)
+            current = node.feature if len(node.children) > 0 else -1
+            candidate = int(np.argmax(scores)) if len(scores) > 0 else -1
+            if candidate >= 0 and (scores[candidate] <= 0 or node.depth >= node.max_depth):
+                candidate = -1
+            if delta is not None and current >= 0 and candidate != current:
+                n = node.class_counts.sum()
+                epsilon = goodness_range * np.sqrt(np.log(1 / delta) / (2 * n))
+                if (scores[candidate] if candidate >= 0 else 0) - scores[current] <= epsilon:
+                    candidate = current
+            cut = None
+            if candidate >= 0:
+                block = encoded.feature_block(node.split_counts, candidate)
+                if candidate in encoded.numeric:
+                    cut = encoded.best_cut(block, kernel, self.gain_ratio)
+                    if delta is not None and candidate == current:
+                        cut = node.threshold_code # a kept numeric split keeps its threshold
+                    block = np.stack([block[:cut + 1].sum(axis=0), block[cut + 1:].sum(axis=0)])
+                if node._chi_prunes(block[block.sum(axis=1) > 0]):
+                    candidate = -1
+                    cut = None
+
+            if candidate == current and cut == node.threshold_code and not stray.get(id(node), False):
+                if current >= 0:
+                    node.goodness = scores[current]
+                for child in node.children:
+                    if id(child) in reached_rows:
+                        queue.append(child)
+                continue
+            node.children = []
+            node.children_values = []
+            node.terminal = False
+            node.feature = -1
+            node.goodness = None
+            node.threshold = node.threshold_code = None
+            subtree = deque([node])
+            while subtree:
+                subtree_node = subtree.popleft()
+                subtree_node.split()
+                subtree.extend(subtree_node.children)
+            regrown += 1
+        return regrown
 
     def predict(self, instance):
         """
@@ -400,6 +2384,9 @@ class DecisionTree:
         node = self.root
         while not node.terminal:
             value = instance[node.feature]
+            if node.threshold is not None:
+                node = node.children[0] if float(value) <= node.threshold else node.children[1]
+                continue
             found = False
             for i in range(len(node.children_values)):
                 if node.children_values[i] == value:
@@ -413,12 +2400,186 @@ class DecisionTree:
         ###########################################################################
         return node.pred
 
+    def pruned(self, max_depth=None, chi=None):
+        """
+        Derive a pruned view of the built tree without rebuilding it. The view
+        predicts exactly like a tree built directly with the given parameters,
+        as long as they prune at least as much as the tree's own parameters.
+
+        Input:
+        - max_depth: the maximum allowed depth of the view (default: the tree's).
+        - chi: the P-value cutoff used for chi square pruning (default: the tree's).
+
+        Output: a new DecisionTree sharing the training data and the nodes'
+                row slices with this tree.
+        """
+        max_depth = self.max_depth if max_depth is None else max_depth
+        chi = self.chi if chi is None else chi
+        if max_depth > self.max_depth or (self.chi < 1.0 and chi > self.chi):
+            raise ValueError("A view can not prune less than the tree it is derived from "
+                             "(max_depth={}, chi={})".format(self.max_depth, self.chi))
+
+        view = DecisionTree(self.data, self.impurity_func, chi=chi, max_depth=max_depth,
+                            gain_ratio=self.gain_ratio, split_cache=self.split_cache)
+        view.encoded = self.encoded
+        view.root = copy.copy(self.root)
+        queue = deque([view.root])
+        while queue:
+            node = queue.popleft()
+            node.max_depth = max_depth
+            node.chi = chi
+            children, children_values = node.children, node.children_values
+            node.children = []
+            node.children_values = []
+            if len(children) == 0:
+                continue
+            if node.depth >= max_depth or (chi < 1.0 and node.chi_square
+                                           < chi_threshold(node.degrees_of_freedom, chi)):
+                node.terminal = True
+                node.feature = -1
+                node.threshold = node.threshold_code = None
+                continue
+            for child, val in zip(children, children_values):
+                child = copy.copy(child)
+                node.add_child(child, val)
+                queue.append(child)
+        return view
+
+    def compile(self):
+        """
+        Flatten the built tree into a CompiledTree. The result is cached until
+        the tree is built again.
+
+        Output: the CompiledTree of the tree.
+        """
+        if self.compiled is not None:
+            return self.compiled
+        vocabs = self.encoded.vocabs
+        value_codes = [{val: code for code, val in enumerate(vocab)} for vocab in vocabs]
+
+        nodes = []
+        queue = deque([self.root])
+        while queue:
+            node = queue.popleft()
+            nodes.append(node)
+            queue.extend(node.children)
+
+        n_nodes = len(nodes)
+        feature = np.full(n_nodes, -1, dtype=np.intp)
+        child_offset = np.zeros(n_nodes, dtype=np.intp)
+        pred = np.array([value_codes[-1][node.pred] for node in nodes], dtype=np.intp)
+        blocks = []
+        table_size = 0
+        next_id = 1 # children are numbered in the order they were queued
+        for i, node in enumerate(nodes):
+            if node.terminal or len(node.children) == 0:
+                next_id += len(node.children)
+                continue
+            feature[i] = node.feature
+            child_offset[i] = table_size
+            block = np.full(len(vocabs[node.feature]), -1, dtype=np.intp)
+            if node.threshold_code is not None:
+                block[:node.threshold_code + 1] = next_id
+                block[node.threshold_code + 1:] = next_id + 1
+            else:
+                for j, val in enumerate(node.children_values):
+                    block[value_codes[node.feature][val]] = next_id + j
+            next_id += len(node.children)
+            blocks.append(block)
+            table_size += len(block)
+        child_table = np.concatenate(blocks) if blocks else np.empty(0, dtype=np.intp)
+
+        n_total = self.root.class_counts.sum()
+        importance = np.array([_split_importance(node, n_total) for node in nodes], dtype=float)
+        self.compiled = CompiledTree(feature, child_offset, child_table, pred, vocabs, importance)
+        return self.compiled
+
+    def feature_importances(self, normalize=True):
+        """
+        Calculate the importance of every feature in one walk over the built
+        tree, from the goodness of split recorded when the nodes were split.
+        Every split node contributes (node_rows / n_total) * goodness to its
+        feature (the value of calc_feature_importance, also stored in the
+        nodes' feature_importance).
+
+        Input:
+        - normalize: True to scale the importances to sum to 1.
+
+        Output: an array with the importance of every feature.
+        """
+        importances = np.zeros(self.encoded.n_features)
+        n_total = self.root.class_counts.sum()
+        queue = deque([self.root])
+        while queue:
+            node = queue.popleft()
+            node.feature_importance = _split_importance(node, n_total)
+            if node.feature_importance != 0:
+                importances[node.feature] += node.feature_importance
+            queue.extend(node.children)
+        if normalize and importances.sum() > 0:
+            importances /= importances.sum()
+        return importances
+
+    def save(self, path):
+        """
+        Write the compiled form of the tree to a binary model file, without
+        the training data. The model is loaded back with load_model.
+
+        Input:
+        - path: the file to write.
+
+        This function has no return value
+        """
+        self.compile().save(path)
+
+    def export_predictor(self, path, name='predict', max_nesting=12):
+        """
+        Write a standalone Python module predicting single instances from
+        their raw feature values, generated from the tree (see
+        CompiledTree.predictor_source).
+
+        Input:
+        - path: the module file to write.
+        - name: the name of the prediction function.
+        - max_nesting: the maximal number of tree levels nested in one function.
+
+        This function has no return value
+        """
+        self.compile().export_predictor(path, name, max_nesting)
+
+    def predict_batch(self, X):
+        """
+        Predict a batch of instances with the compiled form of the tree.
+        Gives the same predictions as calling predict on every row.
+
+        Input:
+        - X: a 2D array of instances, optionally with the labels in the last column.
+
+        Output: an array with the prediction of every instance.
+        """
+        return self.compile().predict_batch(X)
+
+    def evaluate(self, dataset, chunksize=None):
+        """
+        Evaluate the tree on a labeled dataset in one vectorized pass per chunk
+        (see CompiledTree.evaluate).
+
+        Input:
+        - dataset: the instances with their labels in the last column (an
+                   array, an EncodedDataset or an iterable of chunks).
+        - chunksize: the number of instances evaluated at a time (default: all of them).
+
+        Output: an Evaluation with the accuracy, confusion matrix, per class
+                precision and recall and per node hit counts.
+        """
+        return self.compile().evaluate(dataset, chunksize)
+
     def calc_accuracy(self, dataset):
         """
         Predict a given dataset 
      
         Input:
-        - dataset: the dataset on which the accuracy is evaluated
+        - dataset: the dataset on which the accuracy is evaluated (may be an EncodedDataset)
      
         Output: the accuracy of the decision tree on the given dataset (%).
         """
@@ -426,19 +2587,342 @@ class DecisionTree:
         ###########################################################################
         # TODO: Implement the function.                                           #
         ###########################################################################
-        for row in dataset:
-            prediction = self.predict(row)
-            if prediction == row[-1]:
-                accuracy += 1
-        accuracy /= len(dataset)
-        accuracy *= 100
+        accuracy = self.evaluate(dataset).accuracy
         ###########################################################################
         #                             END OF YOUR CODE                            #
         ###########################################################################
         return accuracy
         
 
-def depth_pruning(X_train, X_validation):
+### Hyper-parameter sweeps ###
+# A sweep builds one tree per configuration, configurations being dicts with the
+# keys 'impurity' (a name registered in IMPURITY_FUNCS), 'gain_ratio', 'max_depth' and 'chi'.
+
+SWEEP_COLUMNS = ['impurity', 'gain_ratio', 'max_depth', 'chi',
+                 'train_acc', 'validation_acc', 'depth', 'n_nodes',
+                 'cache_hits', 'cache_misses']
+
+def _sweep_config(config):
+    """
+    Fill the missing keys of a sweep configuration with the DecisionTree defaults.
+    """
+    full = {'impurity': 'gini', 'gain_ratio': False, 'max_depth': 1000, 'chi': 1}
+    full.update(config)
+    return full
+
+
+def _impurity_config(name):
+    """
+    Convert a get_best_impurity name (e.g. 'entropy_gain') to a sweep configuration.
+    """
+    return {'impurity': name.split('_')[0], 'gain_ratio': name.endswith('_gain')}
+
+
+def _impurity_name(impurity, gain_ratio):
+    return impurity + '_gain' if gain_ratio else impurity
+
+
+def tree_depth(node):
+    """
+    Calculate the maximal depth of the nodes in a given tree
+
+    Input:
+    - node: a node in the decision tree.
+
+    Output: the maximal depth of a node in the tree.
+    """
+    max_depth = 0
+    queue = deque([node])
+    while queue:
+        node = queue.popleft()
+        max_depth = max(max_depth, node.depth)
+        queue.extend(node.children)
+    return max_depth
+
+
+def _codes_accuracy(compiled, codes):
+    """
+    Calculate the accuracy (%) of a compiled tree on encoded instances whose
+    last column holds the encoded labels.
+    """
+    evaluation = Evaluation(compiled)
+    evaluation.add(codes)
+    return evaluation.accuracy
+
+
+def _evaluate_group(encoded, validation_codes, configs):
+    """
+    Build and measure the trees of sweep configurations that share an impurity
+    function and gain_ratio flag. A single tree is grown, with the loosest
+    max_depth and chi of the group, and every configuration is a pruned view of it.
+
+    Input:
+    - encoded: the EncodedDataset of the training data.
+    - validation_codes: the validation data encoded with the training vocabularies.
+    - configs: complete sweep configurations with the same impurity and gain_ratio.
+
+    Output: the configurations extended with their results (see SWEEP_COLUMNS).
+            The cache counters are those of the shared growth.
+    """
+    hits, misses = SPLIT_CACHE.hits, SPLIT_CACHE.misses
+    chis = [config['chi'] for config in configs]
+    tree = DecisionTree(
+        encoded,
+        impurity_func=IMPURITY_FUNCS[configs[0]['impurity']],
+        chi=1 if max(chis) >= 1 else max(chis),
+        max_depth=max(config['max_depth'] for config in configs),
+        gain_ratio=configs[0]['gain_ratio'],
+        split_cache=SPLIT_CACHE
+    )
+    tree.build_tree()
+    hits, misses = SPLIT_CACHE.hits - hits, SPLIT_CACHE.misses - misses
+
+    results = []
+    for config in configs:
+        view = tree.pruned(max_depth=config['max_depth'], chi=config['chi'])
+        compiled = view.compile()
+        result = dict(config)
+        result['train_acc'] = _codes_accuracy(compiled, encoded.codes)
+        result['validation_acc'] = _codes_accuracy(compiled, validation_codes)
+        result['depth'] = tree_depth(view.root)
+        result['n_nodes'] = compiled.n_nodes
+        result['cache_hits'] = hits
+        result['cache_misses'] = misses
+        results.append(result)
+    return results
+
+
+def _to_shared(array):
+    """
+    Copy an array into a new shared memory block.
+
+    Returns:
+    - shm: the SharedMemory block, to be closed and unlinked by the caller.
+    - spec: the (name, shape, dtype) triplet that _from_shared attaches with.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _from_shared(spec):
+    """
+    Attach to an array created by _to_shared without copying it.
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+_worker_state = {} # the shared data of the running _map_shared pool, in every worker process
+
+
+def _init_shared_worker(specs, vocabs, state, impurities):
+    # Spawned workers only know the measures registered at import time
+    for name, (kernel, impurity_func) in impurities.items():
+        if name not in IMPURITY_FUNCS:
+            register_impurity(name, kernel, impurity_func)
+    _worker_state.clear()
+    _worker_state.update(state)
+    shms = []
+    for name, spec in specs.items():
+        shm, _worker_state[name] = _from_shared(spec)
+        shms.append(shm)
+    _worker_state['shm'] = shms # keep the blocks mapped
+    _worker_state['encoded'] = EncodedDataset(None, codes=_worker_state['encoded'], vocabs=vocabs)
+
+
+def _map_shared(func, tasks, n_jobs, encoded, arrays=None, state=None, impurities=(), chunksize=1):
+    """
+    Map a function over tasks in worker processes that share an encoded
+    dataset. The codes of the dataset and the other arrays are copied once
+    into shared memory, which the workers attach to without copying, rather
+    than being pickled to each of them.
+
+    Input:
+    - func: a module level function, called with one task, which finds the
+            shared data in _worker_state: the EncodedDataset under 'encoded',
+            the arrays and the state under their names.
+    - tasks: the tasks.
+    - n_jobs: the number of worker processes.
+    - encoded: the shared EncodedDataset.
+    - arrays: name -> array, other arrays to share.
+    - state: name -> value, small picklable values the workers need.
+    - impurities: the names of the registered impurity measures the tasks use,
+                  registered in the workers that do not know them.
+    - chunksize: the number of tasks sent to a worker at a time.
+
+    Output: the list of the results of the tasks, in order.
+    """
+    arrays = dict(arrays or {}, encoded=encoded.codes)
+    shms, specs = [], {}
+    try:
+        for name, array in arrays.items():
+            shm, specs[name] = _to_shared(array)
+            shms.append(shm)
+        with ProcessPoolExecutor(n_jobs, initializer=_init_shared_worker,
+                                 initargs=(specs, encoded.vocabs, state or {},
+                                           {name: _IMPURITY_REGISTRATIONS[name] for name in impurities})) as pool:
+            return list(pool.map(func, tasks, chunksize=chunksize))
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+def _group_configs(configs):
+    """
+    Group complete sweep configurations by impurity function and gain_ratio flag.
+
+    Output: the list of the indices of the configurations of every group,
+            in the order the groups first appear.
+    """
+    groups = {} # (impurity, gain_ratio) -> the indices of its configurations
+    for i, config in enumerate(configs):
+        groups.setdefault((config['impurity'], config['gain_ratio']), []).append(i)
+    return list(groups.values())
+
+
+def _run_sweep_group(configs):
+    return _evaluate_group(_worker_state['encoded'], _worker_state['validation'], configs)
+
+
+def run_sweep(X_train, X_validation, configs, n_jobs=None):
+    """
+    Build and evaluate one tree per configuration, in parallel worker processes.
+    The training data is encoded once and shared with the workers through
+    shared memory rather than being pickled to each of them.
+
+    Configurations that share an impurity function and gain_ratio flag are
+    handled by the same process, which grows a single tree and derives each
+    configuration as a pruned view of it (see DecisionTree.pruned). Growths
+    reuse the split statistics of earlier ones through SPLIT_CACHE.
+
+    Input:
+    - X_train: the training data where the last column holds the labels (may be an EncodedDataset)
+    - X_validation: the validation data where the last column holds the labels (may be an EncodedDataset)
+    - configs: the sweep configurations. Missing keys take the DecisionTree defaults.
+    - n_jobs: the number of worker processes (default: one per CPU).
+              With n_jobs=1 the trees are built in the calling process.
+
+    Output: a DataFrame with one row per configuration, in the given order,
+            holding the columns of SWEEP_COLUMNS.
+    """
+    configs = [_sweep_config(config) for config in configs]
+    encoded = X_train if isinstance(X_train, EncodedDataset) else EncodedDataset(X_train)
+    if isinstance(X_validation, EncodedDataset):
+        validation_codes = _translate_codes(X_validation, encoded.vocabs)
+    else:
+        validation_codes = _encode_columns(X_validation, encoded.vocabs)
+
+    groups = _group_configs(configs)
+    tasks = [[configs[i] for i in indices] for indices in groups]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(tasks))
+
+    if n_jobs <= 1:
+        group_results = [_evaluate_group(encoded, validation_codes, task) for task in tasks]
+    else:
+        group_results = _map_shared(_run_sweep_group, tasks, n_jobs, encoded,
+                                    arrays={'validation': validation_codes},
+                                    impurities={config['impurity'] for config in configs})
+
+    results = [None] * len(configs)
+    for indices, task_results in zip(groups, group_results):
+        for i, result in zip(indices, task_results):
+            results[i] = result
+    return pd.DataFrame(results, columns=SWEEP_COLUMNS)
+
+
+CV_METRICS = ['train_acc', 'validation_acc', 'depth', 'n_nodes']
+
+
+def _cv_fold(encoded, order, bounds, fold):
+    """
+    Split an encoded dataset into the training data and validation codes of a fold.
+
+    Input:
+    - encoded: the EncodedDataset of the whole dataset.
+    - order: the shuffled positions of the instances; fold i validates on
+             order[bounds[i]:bounds[i + 1]] and trains on the others.
+    - bounds: the fold boundaries in order.
+    - fold: the fold index.
+
+    Output: the training EncodedDataset and the validation codes of the fold.
+    """
+    validation = order[bounds[fold]:bounds[fold + 1]]
+    train = np.concatenate([order[:bounds[fold]], order[bounds[fold + 1]:]])
+    train_encoded = EncodedDataset(None, codes=encoded.codes[train], vocabs=encoded.vocabs)
+    return train_encoded, encoded.codes[validation]
+
+
+def _evaluate_fold(encoded, order, bounds, fold, configs):
+    train_encoded, validation_codes = _cv_fold(encoded, order, bounds, fold)
+    return [dict(result, fold=fold) for result in _evaluate_group(train_encoded, validation_codes, configs)]
+
+
+def _run_cv_task(task):
+    fold, configs = task
+    return _evaluate_fold(_worker_state['encoded'], _worker_state['order'], _worker_state['bounds'], fold, configs)
+
+
+def cross_validate(data, configs, k=5, n_jobs=None, seed=None):
+    """
+    Evaluate sweep configurations by k-fold cross-validation, running the
+    (fold x configuration group) tasks in parallel worker processes. The data
+    is encoded once and shared with the workers through shared memory, along
+    with the shuffled fold positions, so every worker gathers its own fold.
+    Within a fold, configurations that share an impurity function and
+    gain_ratio flag are pruned views of one tree (see run_sweep).
+
+    Input:
+    - data: the dataset where the last column holds the labels (may be an EncodedDataset).
+    - configs: the sweep configurations. Missing keys take the DecisionTree defaults.
+    - k: the number of folds.
+    - n_jobs: the number of worker processes (default: one per CPU).
+              With n_jobs=1 the trees are built in the calling process.
+    - seed: the seed of the shuffle assigning instances to folds.
+
+    Output:
+    - folds: a DataFrame with one row per (configuration, fold), holding the
+             configuration, 'fold' and the columns of CV_METRICS.
+    - summary: a DataFrame with one row per configuration, in the given order,
+               holding the mean and standard deviation of every metric over the folds.
+    """
+    configs = [_sweep_config(config) for config in configs]
+    encoded = data if isinstance(data, EncodedDataset) else EncodedDataset(data)
+    if not 2 <= k <= len(encoded):
+        raise ValueError("k must be between 2 and the number of instances, got {}".format(k))
+    order = np.random.default_rng(seed).permutation(len(encoded))
+    bounds = np.linspace(0, len(encoded), k + 1).astype(np.intp)
+
+    groups = _group_configs(configs)
+    tasks = [(fold, [configs[i] for i in indices]) for fold in range(k) for indices in groups]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(tasks))
+
+    if n_jobs <= 1:
+        task_results = [_evaluate_fold(encoded, order, bounds, fold, task) for fold, task in tasks]
+    else:
+        task_results = _map_shared(_run_cv_task, tasks, n_jobs, encoded,
+                                   arrays={'order': order}, state={'bounds': bounds},
+                                   impurities={config['impurity'] for config in configs})
+
+    rows = [None] * (len(configs) * k)
+    n_groups = len(groups)
+    for task_index, results in enumerate(task_results):
+        fold = task_index // n_groups
+        indices = groups[task_index % n_groups]
+        for i, result in zip(indices, results):
+            rows[i * k + fold] = dict(result, config=i)
+    config_columns = ['impurity', 'gain_ratio', 'max_depth', 'chi']
+    folds = pd.DataFrame(rows, columns=['config'] + config_columns + ['fold'] + CV_METRICS)
+    summary = folds.groupby('config')[CV_METRICS].agg(['mean', 'std'])
+    summary.columns = ['{}_{}'.format(metric, stat) for metric, stat in summary.columns]
+    summary = pd.concat([folds.groupby('config')[config_columns].first(), summary], axis=1)
+    return folds.drop(columns='config'), summary.reset_index(drop=True)
+
+
+def depth_pruning(X_train, X_validation, n_jobs=None):
     """
     Calculate the training and validation accuracies for different depths
     using the best impurity function and the gain_ratio flag you got
@@ -447,55 +2931,29 @@ def depth_pruning(X_train, X_validation):
     Input:
     - X_train: the training data where the last column holds the labels
     - X_validation: the validation data where the last column holds the labels
+    - n_jobs: the number of worker processes used to build the trees (see run_sweep)
  
     Output: the training and validation accuracies per max depth
     """
     training = []
     validation  = []
-    root = None
-    best_impurity = get_best_impurity(X_train, X_validation)
-
-    for max_depth in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]:
-        ###########################################################################
-        # TODO: Implement the function.                                           #
-        ###########################################################################
-        if best_impurity == 'gini':
-            tree = DecisionTree(
-                X_train,
-                impurity_func=calc_gini,
-                max_depth=max_depth,
-            )
-        elif best_impurity == 'entropy':
-            tree = DecisionTree(
-                X_train,
-                impurity_func=calc_entropy,
-                max_depth=max_depth,
-            )
-        elif best_impurity == 'gini_gain':
-            tree = DecisionTree(
-                X_train,
-                impurity_func=calc_gini,
-                max_depth=max_depth,
-                gain_ratio=True,
-            )
-        else:
-            tree = DecisionTree(
-                X_train,
-                impurity_func=calc_entropy,
-                max_depth=max_depth,
-                gain_ratio=True,
-            )
+    best_impurity = get_best_impurity(X_train, X_validation, n_jobs)
 
-        tree.build_tree()
-        training.append(tree.calc_accuracy(X_train))
-        validation.append(tree.calc_accuracy(X_validation))
-        ###########################################################################
-        #                             END OF YOUR CODE                            #
-        ###########################################################################
+    ###########################################################################
+    # TODO: Implement the function.                                           #
+    ###########################################################################
+    configs = [dict(_impurity_config(best_impurity), max_depth=max_depth)
+               for max_depth in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]]
+    results = run_sweep(X_train, X_validation, configs, n_jobs)
+    training = results['train_acc'].tolist()
+    validation = results['validation_acc'].tolist()
+    ###########################################################################
+    #                             END OF YOUR CODE                            #
+    ###########################################################################
     return training, validation
 
 
-def chi_pruning(X_train, X_test):
+def chi_pruning(X_train, X_test, n_jobs=None):
 
     """
     Calculate the training and validation accuracies for different chi values
@@ -505,6 +2963,7 @@ def chi_pruning(X_train, X_test):
     Input:
     - X_train: the training data where the last column holds the labels
     - X_validation: the validation data where the last column holds the labels
+    - n_jobs: the number of worker processes used to build the trees (see run_sweep)
  
     Output:
     - chi_training_acc: the training accuracy per chi value
@@ -519,39 +2978,16 @@ def chi_pruning(X_train, X_test):
     # TODO: Implement the function.                                           #
     ###########################################################################
     # decide which impurity to use
-    best_impurity = get_best_impurity(X_train, X_test)
-    if best_impurity.startswith('gini'):
-        impurity = calc_gini
-    else:
-        impurity = calc_entropy
-    use_gain = best_impurity.endswith('_gain')
+    best_impurity = get_best_impurity(X_train, X_test, n_jobs)
 
     # iterate over the standard p-value cutoffs in your chi_table
     p_values = sorted(chi_table[1].keys())  # [0.0001, 0.05, 0.1, 0.25, 0.5]
-    for p in p_values:
-        # build tree with this chi cutoff
-        tree = DecisionTree(
-            X_train,
-            impurity_func=impurity,
-            chi=p,
-            max_depth=1000,  # effectively unbounded; pruning comes from chi
-            gain_ratio = use_gain
-        )
-        tree.build_tree()
+    configs = [dict(_impurity_config(best_impurity), chi=p, max_depth=1000) for p in p_values]
+    results = run_sweep(X_train, X_test, configs, n_jobs)
 
-        # record accuracies
-        chi_training_acc.append(tree.calc_accuracy(X_train))
-        chi_validation_acc.append(tree.calc_accuracy(X_test))
-
-        # compute maximal depth of the built tree
-        max_d = 0
-        queue = deque([tree.root])
-        while queue:
-            node = queue.popleft()
-            max_d = max(max_d, node.depth)
-            for c in node.children:
-                queue.append(c)
-        depth.append(max_d)
+    chi_training_acc = results['train_acc'].tolist()
+    chi_validation_acc = results['validation_acc'].tolist()
+    depth = results['depth'].tolist()
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
@@ -584,48 +3020,180 @@ def count_nodes(node):
     return n_nodes
 
 
-def get_best_impurity(X_train, X_validation):
-    gini_tree = DecisionTree(
-        X_train,
-        impurity_func=calc_gini,
-    )
+def get_best_impurity(X_train, X_validation, n_jobs=None):
+    """
+    Find the impurity function and gain_ratio flag with the best validation accuracy.
 
-    entropy_tree = DecisionTree(
-        X_train,
-        impurity_func=calc_entropy,
-    )
+    Input:
+    - X_train: the training data where the last column holds the labels
+    - X_validation: the validation data where the last column holds the labels
+    - n_jobs: the number of worker processes used to build the trees (see run_sweep)
 
-    gini_tree_gain = DecisionTree(
-        X_train,
-        impurity_func=calc_gini,
-        gain_ratio=True,
-    )
+    Output: one of 'gini', 'entropy', 'gini_gain' and 'entropy_gain'.
+    """
+    configs = [{'impurity': 'gini'},
+               {'impurity': 'entropy'},
+               {'impurity': 'gini', 'gain_ratio': True},
+               {'impurity': 'entropy', 'gain_ratio': True}]
+    results = run_sweep(X_train, X_validation, configs, n_jobs)
 
-    entropy_tree_gain = DecisionTree(
-        X_train,
-        impurity_func=calc_entropy,
-        gain_ratio=True,
-    )
+    func2acc = {}
+    for row in results.itertuples():
+        func2acc[_impurity_name(row.impurity, row.gain_ratio)] = row.validation_acc
 
-    gini_tree.build_tree()
-    entropy_tree.build_tree()
-    gini_tree_gain.build_tree()
-    entropy_tree_gain.build_tree()
+    return max(func2acc, key=func2acc.get)
 
-    gini_acc = gini_tree.calc_accuracy(X_validation)
-    entropy_acc = entropy_tree.calc_accuracy(X_validation)
-    gini_acc_gain = gini_tree_gain.calc_accuracy(X_validation)
-    entropy_acc_gain = entropy_tree_gain.calc_accuracy(X_validation)
 
-    func2acc = {}
-    func2acc['gini'] = gini_acc
-    func2acc['entropy'] = entropy_acc
-    func2acc['gini_gain'] = gini_acc_gain
-    func2acc['entropy_gain'] = entropy_acc_gain
+### Ensembles ###
 
-    return max(func2acc, key=func2acc.get)
+def _grow_forest_tree(encoded, params, seed):
+    """
+    Grow one tree of a RandomForest on a bootstrap sample of the encoded
+    training data.
+
+    Input:
+    - encoded: the EncodedDataset of the training data.
+    - params: the tree parameters of the forest (see RandomForest.tree_params).
+    - seed: the SeedSequence of the tree, drawing both its sample and its candidate features.
+
+    Output: the CompiledTree of the tree, without vocabularies.
+    """
+    rng = np.random.default_rng(seed)
+    sample = encoded
+    if params['bootstrap']:
+        rows = rng.integers(0, len(encoded), len(encoded))
+        sample = EncodedDataset(None, codes=encoded.codes[rows], vocabs=encoded.vocabs)
+    tree = DecisionTree(sample, params['impurity_func'], chi=params['chi'], max_depth=params['max_depth'],
+                        gain_ratio=params['gain_ratio'], max_features=params['max_features'], seed=rng)
+    tree.build_tree()
+    compiled = tree.compile()
+    return CompiledTree(compiled.feature, compiled.child_offset, compiled.child_table, compiled.pred,
+                        None, compiled.importance)
+
+
+def _run_forest_tree(seed):
+    params = _worker_state['params']
+    if isinstance(params['impurity_func'], str):
+        params = dict(params, impurity_func=IMPURITY_FUNCS[params['impurity_func']])
+    return _grow_forest_tree(_worker_state['encoded'], params, seed)
+
+
+class RandomForest:
+    """
+    A bagged ensemble of decision trees (a random forest). Every tree is grown
+    on a bootstrap sample of the training instances and only considers
+    max_features features drawn at random at every split; the forest predicts
+    the majority vote of its compiled trees, ties going to the class that
+    sorts first.
+
+    Trees are grown in worker processes that share the encoded training data
+    through shared memory. Every tree draws from its own seed, spawned from
+    the forest's seed, so a seed gives the same forest for any n_jobs.
+    """
+
+    def __init__(self, data, impurity_func, n_trees=100, max_features='sqrt', bootstrap=True,
+                 chi=1, max_depth=1000, gain_ratio=False, seed=None, n_jobs=None):
+        self.data = data # the training data (raw or an EncodedDataset)
+        self.impurity_func = impurity_func # the impurity function of the trees
+        self.n_trees = n_trees # the number of trees
+        self.max_features = max_features # the candidate features per split (see DecisionTree)
+        self.bootstrap = bootstrap # True to grow every tree on a bootstrap sample
+        self.chi = chi # the P-value cutoff used for chi square pruning
+        self.max_depth = max_depth # the maximum allowed depth of the trees
+        self.gain_ratio = gain_ratio # True iff GainRatio is used to score features
+        self.seed = seed # the seed the trees' seeds are spawned from
+        self.n_jobs = n_jobs # the number of worker processes (default: one per CPU)
+        self.vocabs = None # the vocabularies shared by the trees
+        self.trees = [] # the CompiledTree of every tree
+
+    @property
+    def tree_params(self):
+        return {'impurity_func': self.impurity_func, 'max_features': self.max_features,
+                'bootstrap': self.bootstrap, 'chi': self.chi, 'max_depth': self.max_depth,
+                'gain_ratio': self.gain_ratio}
+
+    def build_forest(self):
+        """
+        Grow the trees of the forest.
+
+        This function has no return value
+        """
+        encoded = self.data if isinstance(self.data, EncodedDataset) else EncodedDataset(self.data)
+        self.vocabs = encoded.vocabs
+        params = self.tree_params
+        seeds = np.random.SeedSequence(self.seed).spawn(self.n_trees)
+        n_jobs = min(self.n_jobs or os.cpu_count() or 1, self.n_trees)
+
+        if n_jobs <= 1:
+            trees = [_grow_forest_tree(encoded, params, seed) for seed in seeds]
+        else:
+            # A registered measure goes by name, as the functions register_impurity creates do not pickle
+            name = next((name for name, func in IMPURITY_FUNCS.items() if func is self.impurity_func), None)
+            if name is not None:
+                params = dict(params, impurity_func=name)
+            trees = _map_shared(_run_forest_tree, seeds, n_jobs, encoded, state={'params': params},
+                                impurities=() if name is None else (name,),
+                                chunksize=max(1, self.n_trees // (4 * n_jobs)))
+        for tree in trees:
+            tree.vocabs = self.vocabs
+        self.trees = trees
+
+    def votes(self, X):
+        """
+        Count the votes of the trees for every class.
 
+        Input:
+        - X: a 2D array of instances, optionally with the labels in the last
+             column, or an EncodedDataset.
+
+        Output: an array of shape (len(X), n_classes), the number of trees
+                predicting every class of every instance.
+        """
+        codes = self.trees[0].encode(X)
+        n_classes = len(self.vocabs[-1])
+        votes = np.zeros(len(codes) * n_classes, dtype=np.intp)
+        offsets = np.arange(len(codes)) * n_classes
+
+        def tree_votes(tree):
+            return tree.pred[tree.apply(codes)] + offsets
 
+        n_jobs = min(self.n_jobs or os.cpu_count() or 1, len(self.trees))
+        if n_jobs <= 1:
+            predictions = map(tree_votes, self.trees)
+        else:
+            # Routing is NumPy gathers and comparisons, which release the GIL
+            pool = ThreadPoolExecutor(n_jobs)
+            predictions = pool.map(tree_votes, self.trees)
+            pool.shutdown(wait=False)
+        for cells in predictions:
+            votes += np.bincount(cells, minlength=len(votes))
+        return votes.reshape(len(codes), n_classes)
+
+    def predict_batch(self, X):
+        """
+        Predict a batch of instances by majority vote.
+
+        Input:
+        - X: a 2D array of instances, optionally with the labels in the last
+             column, or an EncodedDataset.
 
+        Output: an array with the prediction of every instance.
+        """
+        return self.vocabs[-1][np.argmax(self.votes(X), axis=1)]
 
+    def predict(self, instance):
+        """
+        Predict a given instance (a row vector, optionally holding its label last).
+        """
+        return self.predict_batch(np.asarray([instance], dtype=object))[0]
 
+    def calc_accuracy(self, dataset):
+        """
+        Calculate the accuracy (%) of the forest on a dataset where the last
+        column holds the labels (may be an EncodedDataset).
+        """
+        if isinstance(dataset, EncodedDataset):
+            labels = dataset.vocabs[-1][dataset.codes[:, -1]]
+        else:
+            labels = np.asarray(dataset)[:, -1]
+        return np.count_nonzero(self.predict_batch(dataset) == labels) / len(labels) * 100
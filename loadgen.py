@@ -0,0 +1,96 @@
+"""
+A load generator for serve.py.
+
+Opens --concurrency connections to a running server, each sending single
+instance prediction requests one after the other, until --requests requests
+were answered. Reports the client side throughput and latency percentiles,
+the accuracy when the instances carry labels, and the server's counters.
+
+Usage:
+    python loadgen.py --port 8765 --data agaricus-lepiota.csv --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def load_instances(path):
+    """
+    Read the instances of a CSV file where the last column holds the labels,
+    the 'class' column being moved there as in the mushroom dataset.
+    """
+    data = pd.read_csv(path).dropna(axis=1)
+    if 'class' in data.columns:
+        data = data[[col for col in data.columns if col != 'class'] + ['class']]
+    return data.to_numpy().tolist()
+
+
+async def client(host, port, instances, counter, n_requests, latencies, predictions):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while counter[0] < n_requests:
+            i = counter[0]
+            counter[0] += 1
+            instance = instances[i % len(instances)]
+            start = time.perf_counter()
+            writer.write(json.dumps({'instance': instance[:-1]}).encode() + b'\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            predictions.append((response.get('prediction'), instance[-1]))
+    finally:
+        writer.close()
+
+
+async def server_stats(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"stats": true}\n')
+    await writer.drain()
+    stats = json.loads(await reader.readline())
+    writer.close()
+    return stats
+
+
+async def run(host, port, instances, n_requests, concurrency):
+    counter = [0]
+    latencies = []
+    predictions = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, instances, counter, n_requests, latencies, predictions)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    report = {'requests': len(latencies),
+              'concurrency': concurrency,
+              'seconds': elapsed,
+              'throughput': len(latencies) / elapsed,
+              'p50_ms': float(p50),
+              'p99_ms': float(p99),
+              'accuracy': 100 * sum(pred == label for pred, label in predictions) / len(predictions),
+              'server': await server_stats(host, port)}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--data', default='agaricus-lepiota.csv',
+                        help='a CSV file of instances, with the labels last (default: the mushroom dataset)')
+    parser.add_argument('--requests', type=int, default=10000, help='the number of requests (default: 10000)')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent connections (default: 32)')
+    args = parser.parse_args(argv)
+
+    instances = load_instances(args.data)
+    report = asyncio.run(run(args.host, args.port, instances, args.requests, args.concurrency))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
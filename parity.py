@@ -0,0 +1,323 @@
+"""
+Parity checks of the decision tree of hw2.py against a reference implementation.
+
+The reference is the straightforward loop implementation the tree started
+from: impurities from pandas value_counts, one boolean mask per feature value,
+a strict '>' scan over the features and a chi square test from the chi_table.
+Every optimization of hw2.py must give the same numbers, so the checks
+compare exactly, not within a tolerance:
+
+- goodness_of_split of every feature at every node of the trees, bit for bit,
+- the trees grown node by node, level-wise and best-first (without a budget),
+  with and without depth and chi pruning, and their predictions,
+- the output of depth_pruning and chi_pruning,
+- the scores a SplitCache shared by categorical and numeric trees returns.
+
+Usage:
+    python parity.py
+    python parity.py --quick
+"""
+import argparse
+import sys
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import bench
+import hw2
+
+SYNTHETIC = (1000, 8, 4, 2) # rows, features, values per feature, classes of the synthetic dataset
+
+
+### Reference implementation ###
+
+def ref_gini(data):
+    label_counts = pd.Series(data[:, -1]).value_counts().to_dict()
+    gini = 0.0
+    for label in label_counts:
+        gini += (label_counts[label] / len(data)) ** 2
+    return 1 - gini
+
+
+def ref_entropy(data):
+    label_counts = pd.Series(data[:, -1]).value_counts().to_dict()
+    entropy = 0.0
+    for label in label_counts:
+        entropy += (label_counts[label] / len(data)) * np.log2(label_counts[label] / len(data))
+    return -1 * entropy
+
+
+REF_IMPURITIES = {'gini': ref_gini, 'entropy': ref_entropy}
+
+
+def ref_goodness_of_split(data, feature, impurity_func, gain_ratio):
+    groups = {}
+    phi_s = impurity_func(data)
+    summ_of_impurities = 0.0
+    for val in list(np.unique(data[:, feature])):
+        groups[val] = data[data[:, feature] == val]
+        summ_of_impurities += (groups[val].shape[0] / len(data)) * impurity_func(groups[val])
+    goodness = phi_s - summ_of_impurities
+    if gain_ratio:
+        split_info = 0.0
+        for subset in groups.values():
+            p = len(subset) / len(data)
+            if p > 0:
+                split_info -= p * np.log2(p)
+        return (goodness / split_info if split_info > 0 else 0.0), groups
+    return goodness, groups
+
+
+def ref_chi_square(data, groups):
+    parent_counts = pd.Series(data[:, -1]).value_counts().to_dict()
+    chi_square = 0.0
+    for subset in groups.values():
+        subset_counts = pd.Series(subset[:, -1]).value_counts().to_dict()
+        for label in parent_counts:
+            expected = (parent_counts[label] / len(data)) * len(subset)
+            if expected > 0:
+                chi_square += (subset_counts.get(label, 0) - expected) ** 2 / expected
+    return chi_square
+
+
+_ref_trees = {} # (id of the data, impurity, chi, max_depth, gain_ratio) -> root of a reference tree
+
+
+def ref_tree(data, impurity, chi=1, max_depth=1000, gain_ratio=False):
+    """
+    Grow a reference tree breadth first. The trees are kept, since the
+    checks ask for the same ones several times and the loops are slow.
+
+    Output: the root node, a dict with the keys 'data', 'depth', 'feature',
+            'pred', 'children' (value -> node).
+    """
+    key = (id(data), impurity, chi, max_depth, gain_ratio)
+    if key not in _ref_trees:
+        _ref_trees[key] = _grow_ref_tree(data, impurity, chi, max_depth, gain_ratio)
+    return _ref_trees[key]
+
+
+def _grow_ref_tree(data, impurity, chi, max_depth, gain_ratio):
+    impurity_func = REF_IMPURITIES[impurity]
+
+    def node(subset, depth):
+        values, counts = np.unique(subset[:, -1], return_counts=True)
+        return {'data': subset, 'depth': depth, 'feature': -1,
+                'pred': values[np.argmax(counts)], 'children': {}}
+
+    root = node(data, 0)
+    queue = deque([root])
+    while queue:
+        current = queue.popleft()
+        subset = current['data']
+        max_goodness, max_feature, max_groups = -float('inf'), None, None
+        for feature in range(subset.shape[1] - 1):
+            goodness, groups = ref_goodness_of_split(subset, feature, impurity_func, gain_ratio)
+            if goodness > max_goodness:
+                max_goodness, max_feature, max_groups = goodness, feature, groups
+        if max_goodness <= 0 or current['depth'] >= max_depth:
+            continue
+        if chi < 1.0:
+            dof = (len(max_groups) - 1) * (len(np.unique(subset[:, -1])) - 1)
+            if ref_chi_square(subset, max_groups) < hw2.chi_table[dof][chi]:
+                continue
+        current['feature'] = max_feature
+        for val, group in max_groups.items():
+            child = node(group, current['depth'] + 1)
+            current['children'][val] = child
+            queue.append(child)
+    return root
+
+
+def ref_predict(root, instance):
+    node = root
+    while node['children'] and instance[node['feature']] in node['children']:
+        node = node['children'][instance[node['feature']]]
+    return node['pred']
+
+
+def ref_accuracy(root, dataset):
+    return sum(ref_predict(root, row) == row[-1] for row in dataset) / len(dataset) * 100
+
+
+def ref_depth(root):
+    depth = 0
+    queue = deque([root])
+    while queue:
+        node = queue.popleft()
+        depth = max(depth, node['depth'])
+        queue.extend(node['children'].values())
+    return depth
+
+
+def ref_best_impurity(X_train, X_validation):
+    func2acc = {}
+    for impurity in ('gini', 'entropy'):
+        for gain_ratio in (False, True):
+            root = ref_tree(X_train, impurity, gain_ratio=gain_ratio)
+            func2acc[impurity + ('_gain' if gain_ratio else '')] = ref_accuracy(root, X_validation)
+    return max(['gini', 'entropy', 'gini_gain', 'entropy_gain'], key=func2acc.get)
+
+
+def ref_depth_pruning(X_train, X_validation):
+    best = ref_best_impurity(X_train, X_validation)
+    training, validation = [], []
+    for max_depth in range(1, 11):
+        root = ref_tree(X_train, best.split('_')[0], max_depth=max_depth, gain_ratio=best.endswith('_gain'))
+        training.append(ref_accuracy(root, X_train))
+        validation.append(ref_accuracy(root, X_validation))
+    return training, validation
+
+
+def ref_chi_pruning(X_train, X_test):
+    best = ref_best_impurity(X_train, X_test)
+    training, validation, depth = [], [], []
+    for p in sorted(hw2.chi_table[1].keys()):
+        root = ref_tree(X_train, best.split('_')[0], chi=p, gain_ratio=best.endswith('_gain'))
+        training.append(ref_accuracy(root, X_train))
+        validation.append(ref_accuracy(root, X_test))
+        depth.append(ref_depth(root))
+    return training, validation, depth
+
+
+### Checks ###
+
+def ref_structure(node):
+    """
+    A comparable form of a reference subtree.
+    """
+    return (node['feature'], node['pred'],
+            tuple((val, ref_structure(child)) for val, child in sorted(node['children'].items())))
+
+
+def structure(node):
+    """
+    A comparable form of a hw2.py subtree.
+    """
+    if node.terminal or len(node.children) == 0:
+        return (-1, node.pred, ())
+    children = sorted(zip(node.children_values, node.children), key=lambda pair: pair[0])
+    return (node.feature, node.pred, tuple((val, structure(child)) for val, child in children))
+
+
+def check_goodness(name, X_train, X_validation):
+    """
+    Compare goodness_of_split at every node of the fully grown reference trees.
+    """
+    failures = []
+    for impurity in ('gini', 'entropy'):
+        for gain_ratio in (False, True):
+            root = ref_tree(X_train, impurity, gain_ratio=gain_ratio)
+            nodes = []
+            queue = deque([root])
+            while queue:
+                node = queue.popleft()
+                nodes.append(node)
+                queue.extend(node['children'].values())
+            for node in nodes:
+                subset = node['data']
+                tree_node = hw2.DecisionNode(subset, hw2.IMPURITY_FUNCS[impurity], gain_ratio=gain_ratio)
+                for feature in range(subset.shape[1] - 1):
+                    expected, _ = ref_goodness_of_split(subset, feature, REF_IMPURITIES[impurity], gain_ratio)
+                    actual, _ = tree_node.goodness_of_split(feature)
+                    if expected != actual:
+                        failures.append('{} goodness_of_split {}{} feature {} on {} rows: {!r} != {!r}'.format(
+                            name, impurity, ' gain_ratio' if gain_ratio else '', feature,
+                            len(subset), actual, expected))
+    return failures
+
+
+def check_trees(name, X_train, X_validation):
+    """
+    Compare the trees of every growth mode, and their predictions, with the reference trees.
+    """
+    failures = []
+    for impurity in ('gini', 'entropy'):
+        for gain_ratio in (False, True):
+            for chi, max_depth in ((1, 1000), (1, 3), (0.05, 1000)):
+                root = ref_tree(X_train, impurity, chi=chi, max_depth=max_depth, gain_ratio=gain_ratio)
+                expected = ref_structure(root)
+                predictions = [ref_predict(root, row) for row in X_validation]
+                for growth in ('node', 'level', 'best'):
+                    tree = hw2.DecisionTree(X_train, hw2.IMPURITY_FUNCS[impurity], chi=chi,
+                                            max_depth=max_depth, gain_ratio=gain_ratio, growth=growth)
+                    tree.build_tree()
+                    label = '{} {}{} chi={} max_depth={} growth={}'.format(
+                        name, impurity, ' gain_ratio' if gain_ratio else '', chi, max_depth, growth)
+                    if structure(tree.root) != expected:
+                        failures.append(label + ': different tree')
+                    elif list(tree.predict_batch(X_validation)) != predictions:
+                        failures.append(label + ': different predictions')
+    return failures
+
+
+def check_pruning(name, X_train, X_validation):
+    """
+    Compare depth_pruning and chi_pruning with the reference.
+    """
+    failures = []
+    hw2.SPLIT_CACHE.clear()
+    if hw2.depth_pruning(X_train, X_validation, n_jobs=1) != ref_depth_pruning(X_train, X_validation):
+        failures.append(name + ' depth_pruning: different accuracies')
+    if hw2.chi_pruning(X_train, X_validation, n_jobs=1) != ref_chi_pruning(X_train, X_validation):
+        failures.append(name + ' chi_pruning: different accuracies or depths')
+    return failures
+
+
+def check_split_cache(name, X_train, X_validation):
+    """
+    Check that trees sharing a SplitCache score their nodes as trees without
+    one do, when the same codes are read as categorical and as numeric
+    features: the first column is replaced by the integer code of its value.
+    """
+    def nodes(node):
+        yield node
+        for child in node.children:
+            yield from nodes(child)
+
+    failures = []
+    data = X_train.copy()
+    data[:, 0] = np.unique(data[:, 0], return_inverse=True)[1]
+    cache = hw2.SplitCache()
+    shared = [hw2.DecisionTree(data, hw2.calc_gini, numeric_features=numeric_features, split_cache=cache)
+              for numeric_features in ([], [0])]
+    for tree in shared:
+        tree.build_tree()
+    for tree in shared:
+        alone = hw2.DecisionTree(data, hw2.calc_gini, numeric_features=tree.numeric_features)
+        alone.build_tree()
+        label = '{} split_cache numeric_features={}'.format(name, tree.numeric_features)
+        if structure(tree.root) != structure(alone.root):
+            failures.append(label + ': different tree')
+        elif any(not np.array_equal(cached._feature_scores(), fresh._feature_scores())
+                 for cached, fresh in zip(nodes(tree.root), nodes(alone.root))):
+            failures.append(label + ': different cached scores')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='only the synthetic dataset')
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='the number of mushroom instances used (default: 1000)')
+    args = parser.parse_args(argv)
+
+    datasets = {'synthetic': bench.make_dataset(*SYNTHETIC)}
+    if not args.quick:
+        datasets['mushroom'] = bench.load_mushroom()[:args.rows]
+
+    failures = []
+    for name, data in datasets.items():
+        X_train, X_validation = bench.split_dataset(data)
+        for check in (check_goodness, check_trees, check_pruning, check_split_cache):
+            found = check(name, X_train, X_validation)
+            print('{:<10} {:<18} {}'.format(name, check.__name__, 'ok' if not found else 'FAILED'))
+            failures += found
+    for failure in failures:
+        print('MISMATCH ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+A local prediction server for trees of hw2.py.
+
+Loads a model file written by DecisionTree.save once and answers prediction
+requests over TCP, one JSON object per line. Concurrent single instance
+requests are coalesced into micro-batches (up to --max-batch-size instances,
+waiting at most --max-wait-ms for a batch to fill) and every batch is routed
+through the compiled tree at once.
+
+Requests and responses:
+    {"instance": ["x", "s", ...]}   ->  {"prediction": "e"}
+    {"stats": true}                 ->  {"requests": ..., "throughput": ..., ...}
+
+Usage:
+    python serve.py model.bin --port 8765
+    python loadgen.py --port 8765 --data agaricus-lepiota.csv
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+import hw2
+
+
+class ServerStats:
+    """
+    Counters of a running server: requests, batches, throughput and the
+    latency of the most recent requests.
+    """
+
+    def __init__(self, window=10000):
+        self.n_requests = 0 # requests answered
+        self.n_batches = 0 # batches predicted
+        self.n_errors = 0 # requests that failed
+        self.latencies = deque(maxlen=window) # seconds from arrival to answer, most recent requests
+        self._start = time.perf_counter()
+
+    def record_batch(self, latencies):
+        self.n_batches += 1
+        self.n_requests += len(latencies)
+        self.latencies.extend(latencies)
+
+    def summary(self, queue_depth=0):
+        elapsed = time.perf_counter() - self._start
+        latencies = np.array(self.latencies) * 1000
+        p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) > 0 else (0.0, 0.0)
+        return {'requests': self.n_requests,
+                'batches': self.n_batches,
+                'errors': self.n_errors,
+                'mean_batch_size': self.n_requests / self.n_batches if self.n_batches else 0.0,
+                'throughput': self.n_requests / elapsed if elapsed > 0 else 0.0,
+                'queue_depth': queue_depth,
+                'p50_ms': float(p50),
+                'p99_ms': float(p99),
+                'uptime': elapsed}
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent predictions into batches routed through a compiled tree.
+
+    A single task drains the queue: it takes the first waiting instance, then
+    keeps collecting until max_batch_size instances are waiting or max_wait
+    seconds passed, and predicts them with one predict_batch call in a worker
+    thread, so new requests keep being accepted meanwhile.
+    """
+
+    def __init__(self, model, max_batch_size=64, max_wait=0.002):
+        self.model = model # the CompiledTree answering the requests
+        self.max_batch_size = max_batch_size # the maximal number of instances per batch
+        self.max_wait = max_wait # the maximal seconds the first instance of a batch waits for others
+        self.stats = ServerStats()
+        self.queue = asyncio.Queue() # (instance, future, arrival time) of the waiting requests
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    @property
+    def n_features(self):
+        return len(self.model.vocabs) - 1
+
+    async def predict(self, instance):
+        # Instances may hold their label last, as in predict_batch
+        if not isinstance(instance, list) or len(instance) not in (self.n_features, self.n_features + 1):
+            self.stats.n_errors += 1
+            raise ValueError("An instance must be a list of {} feature values".format(self.n_features))
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((instance, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _predict(self, batch):
+        """
+        Predict a batch of queued requests. When the batch fails, its
+        instances are predicted one by one, so a bad instance only fails its
+        own request.
+
+        Output: the prediction, or the exception, of every request.
+        """
+        instances = np.empty((len(batch), self.n_features), dtype=object)
+        try:
+            for i, (instance, _, _) in enumerate(batch):
+                instances[i] = instance[:self.n_features]
+            return list(self.model.predict_batch(instances))
+        except Exception:
+            if len(batch) == 1:
+                raise
+        results = []
+        for request in batch:
+            try:
+                results.append(self._predict([request])[0])
+            except Exception as error:
+                results.append(error)
+        return results
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            try:
+                results = await loop.run_in_executor(None, self._predict, batch)
+            except Exception as error:
+                results = [error] * len(batch)
+            now = time.perf_counter()
+            answered = []
+            for (_, future, arrival), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    self.stats.n_errors += 1
+                    future.set_exception(result)
+                else:
+                    future.set_result(result.item() if isinstance(result, np.generic) else result)
+                    answered.append(now - arrival)
+            self.stats.record_batch(answered)
+
+    def summary(self):
+        return self.stats.summary(self.queue.qsize())
+
+
+async def handle_client(batcher, reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                if request.get('stats'):
+                    response = batcher.summary()
+                else:
+                    response = {'prediction': await batcher.predict(request['instance'])}
+            except Exception as error:
+                response = {'error': '{}: {}'.format(type(error).__name__, error)}
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(model, host, port, max_batch_size, max_wait, stats_interval=0):
+    batcher = MicroBatcher(model, max_batch_size, max_wait)
+    batcher.start()
+    server = await asyncio.start_server(lambda r, w: handle_client(batcher, r, w), host, port)
+    print('Serving {} nodes on {}:{}'.format(model.n_nodes, host, port))
+    try:
+        async with server:
+            if stats_interval > 0:
+                while True:
+                    await asyncio.sleep(stats_interval)
+                    print(json.dumps(batcher.summary()))
+            else:
+                await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('model', help='a model file written by DecisionTree.save')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch-size', type=int, default=64, help='instances per batch (default: 64)')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0,
+                        help='how long a batch waits to fill, in milliseconds (default: 2)')
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help='print the server counters every this many seconds (default: never)')
+    args = parser.parse_args(argv)
+
+    model = hw2.load_model(args.model)
+    try:
+        asyncio.run(serve(model, args.host, args.port, args.max_batch_size,
+                          args.max_wait_ms / 1000, args.stats_interval))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())